@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import numpy as np
+
+"""
+Benchmark of the vectorized assignment/centroid-update engine in kmeans.cluster
+against the original Python loop implementation, on the bundled data files.
+Both engines start from the same initial centroids, so only the clustering
+iterations are timed, and the resulting cluster assignments are compared
+(the loop rounds the centroids to 3 decimals, so they are compared to 0.001).
+Usage: bench_cluster.py <number of clusters> <datafile> <datafile> ...
+Without arguments all files in the data folder are used with 20 clusters.
+"""
+
+code_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+sys.path.append(code_path)
+from cluster import kmeans
+
+
+def legacy_cluster(kmeans_instance, centroids):
+    '''The original loop based clustering from cluster.py, starting from the given centroids'''
+    convergence = False
+    max_iterations = 200
+    iteration = 0
+    while not convergence and iteration <= max_iterations:
+        new_centroids = list()
+        cluster_dict = {"Cluster-" + str(i+1): list() for i in range(kmeans_instance.clusters)}
+        for i in range(kmeans_instance.data.shape[0]):
+            distances = list()
+            for j in range(kmeans_instance.clusters):
+                distance = kmeans_instance._euclidian(kmeans_instance.data[i], centroids[j])
+                distances.append(distance)
+            min_distance = min(distances)
+            min_index = distances.index(min_distance)
+            cluster_key = "Cluster-" + str(min_index+1)
+            cluster_dict[cluster_key].append(i)
+        for key in cluster_dict.keys():
+            index_ls = cluster_dict[key]
+            rows = len(index_ls)
+            cols = kmeans_instance.data.shape[1]
+            centroid_data = np.empty(shape=(rows, cols), dtype=np.float64)
+            for i, index in enumerate(index_ls):
+                centroid_data[i] = kmeans_instance.data[index]
+            centroid = np.mean(centroid_data, axis = 0)
+            centroid = np.round(centroid, decimals=3)
+            new_centroids.append(centroid)
+        if np.array_equal(centroids, new_centroids):
+            convergence = True
+        iteration += 1
+        centroids = new_centroids
+    return cluster_dict, centroids
+
+
+def benchmark_file(filename, clusters):
+    '''Times the legacy loop and the vectorized engine on one data file'''
+    my_kmeans = kmeans(filename, min(clusters, len(open(filename).readlines())))
+    # Pick the initial centroids once and let both engines start from them
+    initial_centroids = my_kmeans._pick_centroids_kmeans_plusplus()
+    my_kmeans._pick_centroids = lambda: np.array(initial_centroids)
+    # Run until no point changes cluster, as the loop does
+    my_kmeans.tol = 0
+    start = time.perf_counter()
+    legacy_dict, legacy_centroids = legacy_cluster(my_kmeans, initial_centroids)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    new_dict, new_centroids = my_kmeans.cluster()
+    new_time = time.perf_counter() - start
+    # The loop rounds the centroids to 3 decimals, so only the clusters are expected to be identical
+    identical = legacy_dict == dict(new_dict) and np.allclose(legacy_centroids, new_centroids, atol=0.001)
+    return my_kmeans.data.shape[0], legacy_time, new_time, identical
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        clusters = 20
+        filenames = [os.path.join(data_path, name) for name in sorted(os.listdir(data_path))]
+    elif len(sys.argv) >= 3 and sys.argv[1].isdigit():
+        clusters = int(sys.argv[1])
+        filenames = sys.argv[2:]
+    else:
+        sys.stderr.write("Usage: bench_cluster.py <number of clusters> <datafilename> ... \n")
+        sys.exit(1)
+    print("file\tpoints\tloop (s)\tvectorized (s)\tspeedup\tidentical")
+    for filename in filenames:
+        np.random.seed(42)
+        points, legacy_time, new_time, identical = benchmark_file(filename, clusters)
+        print(f"{os.path.basename(filename)}\t{points}\t{legacy_time:.3f}\t{new_time:.3f}\t{legacy_time / new_time:.1f}x\t{identical}")
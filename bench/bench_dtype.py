@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import tracemalloc
+import numpy as np
+
+"""
+Benchmark of the float64 and float32 data types of the kmeans class.
+The data file is loaded and clustered with dtype float64 and float32 from the same
+seed. The best time and the peak memory (from tracemalloc) of the load, the size of
+the data, the best time of the clustering and whether the labels are the same as
+with float64 are reported.
+Usage: bench_dtype.py <datafile> <number of clusters> [--repeat=<runs>]
+Without arguments data/point10000.lst is clustered with 8 clusters.
+"""
+
+code_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+sys.path.append(code_path)
+from cluster import kmeans
+
+
+def benchmark_dtype(filename, clusters, dtype, repeat):
+    '''Loads and clusters the data with the given dtype. Returns the load time, peak memory of the load,
+    size of the data, best cluster time, number of iterations and the labels'''
+    load_times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        kmeans(dtype = dtype).load(filename)
+        load_times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    my_kmeans = kmeans(clusters = clusters, seed = 0, dtype = dtype)
+    my_kmeans.load(filename)
+    load_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    cluster_times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        my_kmeans.cluster()
+        cluster_times.append(time.perf_counter() - start)
+    return min(load_times), load_peak, my_kmeans.data.nbytes, min(cluster_times), my_kmeans.n_iter, my_kmeans.labels
+
+
+if __name__ == "__main__":
+    options = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    repeat = 5
+    for option in options:
+        if option.startswith("--repeat=") and option[len("--repeat="):].isdigit() and int(option[len("--repeat="):]) > 0:
+            repeat = int(option[len("--repeat="):])
+        else:
+            sys.stderr.write("Usage: bench_dtype.py <datafilename> <number of clusters> [--repeat=<runs>] \n")
+            sys.exit(1)
+    if len(arguments) == 0:
+        filename = os.path.join(data_path, "point10000.lst")
+        clusters = 8
+    elif len(arguments) == 2 and arguments[1].isdigit():
+        filename = arguments[0]
+        clusters = int(arguments[1])
+    else:
+        sys.stderr.write("Usage: bench_dtype.py <datafilename> <number of clusters> [--repeat=<runs>] \n")
+        sys.exit(1)
+    print(f"{os.path.basename(filename)}, {clusters} clusters, best of {repeat} runs")
+    print("dtype\tload (s)\tload peak (MB)\tdata (MB)\tcluster (s)\titerations\tsame labels")
+    reference = None
+    for dtype in ("float64", "float32"):
+        load_time, load_peak, size, cluster_time, iterations, labels = benchmark_dtype(filename, clusters, dtype, repeat)
+        if reference is None:
+            reference = labels
+        print(f"{dtype}\t{load_time:.4f}\t{load_peak / 2**20:.2f}\t{size / 2**20:.3f}\t{cluster_time:.4f}\t{iterations}\t{np.array_equal(labels, reference)}")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import numpy as np
+
+"""
+Benchmark of the mini-batch algorithm against full batch k-means (Lloyd).
+For each seed both algorithms cluster the same data, and the wall time and the
+final sum-of-squares (E from elbow_extension.calculate_E) are reported.
+Usage: bench_minibatch.py <datafile> <number of clusters> <number of seeds>
+Without arguments data/point10000.lst is clustered with 20 clusters and 5 seeds.
+"""
+
+code_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+sys.path.append(code_path)
+from cluster import kmeans
+from elbow_extension import calculate_E
+
+
+def benchmark_algorithm(filename, clusters, algorithm, seed, batch_size = 1024):
+    '''Clusters the data once with the given algorithm and returns the wall time, E and the number of iterations'''
+    my_kmeans = kmeans(filename, clusters, seed = seed)
+    my_kmeans.algorithm = algorithm
+    my_kmeans.batch_size = batch_size
+    start = time.perf_counter()
+    my_kmeans.cluster()
+    wall_time = time.perf_counter() - start
+    return wall_time, calculate_E(my_kmeans), my_kmeans.n_iter
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        filename = os.path.join(data_path, "point10000.lst")
+        clusters = 20
+        seeds = 5
+    elif len(sys.argv) == 4 and sys.argv[2].isdigit() and sys.argv[3].isdigit():
+        filename = sys.argv[1]
+        clusters = int(sys.argv[2])
+        seeds = int(sys.argv[3])
+    else:
+        sys.stderr.write("Usage: bench_minibatch.py <datafilename> <number of clusters> <number of seeds> \n")
+        sys.exit(1)
+    print("algorithm\tseed\ttime (s)\tE\titerations")
+    results = {"lloyd": list(), "minibatch": list()}
+    for seed in range(seeds):
+        for algorithm in results.keys():
+            wall_time, E, iterations = benchmark_algorithm(filename, clusters, algorithm, seed)
+            results[algorithm].append((wall_time, E))
+            print(f"{algorithm}\t{seed}\t{wall_time:.3f}\t{E:.4e}\t{iterations}")
+    lloyd = np.mean(results["lloyd"], axis=0)
+    minibatch = np.mean(results["minibatch"], axis=0)
+    print(f"mean time: lloyd {lloyd[0]:.3f} s, minibatch {minibatch[0]:.3f} s ({lloyd[0] / minibatch[0]:.1f}x faster)")
+    print(f"mean E: lloyd {lloyd[1]:.4e}, minibatch {minibatch[1]:.4e} ({100 * (minibatch[1] / lloyd[1] - 1):.1f}% higher)")
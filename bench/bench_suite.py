@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import json
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+
+"""
+Benchmark suite for the stages of the k-means pipeline: load, k-means++ seeding
+(_pick_centroids_kmeans_plusplus), cluster, write, the elbow sweep and PCA.
+Every stage is timed separately (best of --repeat runs) and its peak memory is
+measured in one more run with tracemalloc. The stages are run on the bundled
+data files and on synthetic Gaussian blobs where the number of points (n),
+dimensions (d) and clusters (k) are varied one at a time, which gives the
+scaling curves. The results are saved as JSON together with the commit, so two
+runs can be compared with --compare.
+Usage: bench_suite.py [--quick] [--repeat=<runs>] [--output=<json file>] [--compare=<json file>]
+Without arguments all stages are run and the results are saved in bench_results.json.
+"""
+
+code_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+sys.path.append(code_path)
+from cluster import kmeans
+from elbow_extension import elbow_sweep
+from PCA_extension import fit_pca, transform_pca
+
+
+# Default size of the synthetic data, and the values each parameter is varied over for the scaling curves
+DEFAULTS = {"n": 10000, "d": 8, "k": 8}
+SCALING = {"n": [1000, 10000, 100000], "d": [2, 8, 32, 128], "k": [2, 8, 32, 128]}
+QUICK_SCALING = {"n": [1000, 10000], "d": [2, 8], "k": [2, 8]}
+
+
+def make_blobs(filename, n, d, k, seed = 0):
+    '''Writes n points with d dimensions drawn around k random centers to a .lst file with ids'''
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, 100, size=(k, d))
+    points = centers[rng.integers(k, size=n)] + rng.normal(scale=5, size=(n, d))
+    with open(filename, "w") as outfile:
+        for i, point in enumerate(points):
+            outfile.write("point" + str(i+1) + "\t" + "\t".join(str(value) for value in point) + "\n")
+
+
+def measure(stage, repeat):
+    '''Runs stage() repeat times and once more with tracemalloc. Returns the best time, the peak memory
+    in bytes and the result of the last run'''
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    stage()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak, result
+
+
+def benchmark_dataset(name, filename, clusters, repeat, extensions = True):
+    '''Times every stage on one data file and returns a list with a dict for each stage'''
+    my_kmeans = kmeans(filename, clusters, seed=0)
+    n, d = my_kmeans.data.shape
+    stages = {
+        "load": lambda: kmeans().load(filename),
+        "seed": lambda: my_kmeans._pick_centroids_kmeans_plusplus(np.random.default_rng(0)),
+        "cluster": lambda: (my_kmeans.cluster(), my_kmeans.n_iter)[1],
+        "write": lambda: my_kmeans.write(os.devnull),
+    }
+    if extensions:
+        stages["elbow"] = lambda: elbow_sweep(kmeans(filename, seed=0), min(10, n))
+        stages["pca"] = lambda: transform_pca(my_kmeans.data, fit_pca(my_kmeans.data, n_components=min(2, d)))
+    results = list()
+    for stage, function in stages.items():
+        # write prints a message for every run
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                seconds, peak, value = measure(function, repeat)
+            finally:
+                sys.stdout = stdout
+        result = {"dataset": name, "stage": stage, "n": n, "d": d, "k": clusters, "seconds": seconds, "peak_bytes": peak}
+        if stage == "cluster":
+            result["iterations"] = value
+            result["iterations_per_second"] = value / seconds
+        results.append(result)
+        print(f"{name}\t{stage}\t{n}\t{d}\t{clusters}\t{seconds:.4f}\t{peak / 2**20:.1f}" +
+              (f"\t{result['iterations_per_second']:.1f}" if stage == "cluster" else ""))
+    return results
+
+
+def scaling_curves(results, scaling):
+    '''Collects the cluster time and iterations per second of the synthetic data sets for each varied parameter'''
+    curves = dict()
+    for parameter, values in scaling.items():
+        curve = list()
+        for value in values:
+            for result in results:
+                if result["dataset"] == f"synthetic-{parameter}={value}" and result["stage"] == "cluster":
+                    curve.append({parameter: value, "seconds": result["seconds"], "iterations_per_second": result["iterations_per_second"]})
+        curves[parameter] = curve
+    return curves
+
+
+def environment():
+    '''The commit and the versions the benchmark was run with'''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=code_path).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "cpus": os.cpu_count(), "machine": platform.machine()}
+
+
+def compare(results, old_filename):
+    '''Prints the time of every stage relative to the same stage in an earlier run'''
+    old = json.load(open(old_filename))
+    old_seconds = {(result["dataset"], result["stage"]): result["seconds"] for result in old["results"]}
+    print(f"Compared to commit {old['environment']['commit'][:10]} (ratio > 1 is slower now)")
+    print("dataset\tstage\tbefore (s)\tnow (s)\tratio")
+    for result in results:
+        key = (result["dataset"], result["stage"])
+        if key in old_seconds:
+            print(f"{key[0]}\t{key[1]}\t{old_seconds[key]:.4f}\t{result['seconds']:.4f}\t{result['seconds'] / old_seconds[key]:.2f}")
+
+
+if __name__ == "__main__":
+    quick = False
+    repeat = 3
+    output = "bench_results.json"
+    old_filename = None
+    for argument in sys.argv[1:]:
+        if argument == "--quick":
+            quick = True
+        elif argument.startswith("--repeat=") and argument[9:].isdigit() and int(argument[9:]) > 0:
+            repeat = int(argument[9:])
+        elif argument.startswith("--output="):
+            output = argument[9:]
+        elif argument.startswith("--compare="):
+            old_filename = argument[10:]
+        else:
+            sys.stderr.write("Usage: bench_suite.py [--quick] [--repeat=<runs>] [--output=<json file>] [--compare=<json file>] \n")
+            sys.exit(1)
+    scaling = QUICK_SCALING if quick else SCALING
+    print("dataset\tstage\tn\td\tk\ttime (s)\tpeak memory (MB)\titerations/s")
+    results = list()
+    for name in sorted(os.listdir(data_path)):
+        if name.endswith(".lst") and not (quick and name != "point1000.lst"):
+            results += benchmark_dataset(name, os.path.join(data_path, name), DEFAULTS["k"], repeat)
+    # The default size is part of every curve, so the results of each size are kept and reused
+    synthetic = dict()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for parameter, values in scaling.items():
+            for value in values:
+                size = dict(DEFAULTS, **{parameter: value})
+                key = (size["n"], size["d"], size["k"])
+                name = f"synthetic-{parameter}={value}"
+                if key not in synthetic:
+                    filename = os.path.join(tmpdir, "blobs_%d_%d_%d.lst" % key)
+                    make_blobs(filename, size["n"], size["d"], size["k"])
+                    # The extensions are only run on the bundled data
+                    synthetic[key] = benchmark_dataset(name, filename, size["k"], repeat, extensions=False)
+                results += [dict(result, dataset=name) for result in synthetic[key]]
+    report = {"environment": environment(), "repeat": repeat, "results": results, "scaling": scaling_curves(results, scaling)}
+    with open(output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print("Results were written to " + output)
+    if old_filename is not None:
+        compare(results, old_filename)
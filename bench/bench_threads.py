@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+# The BLAS library is kept to one thread, so only the threads of the kmeans class are measured
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+import time
+import numpy as np
+
+"""
+Benchmark of the threaded distance computations of the kmeans class.
+The same data is clustered with 1, 2, 4 and 8 threads (n_threads) from the same
+seed, and the wall time, the speedup over one thread and whether the result is
+exactly the same as with one thread are reported.
+Usage: bench_threads.py <datafile> <number of clusters>
+Without arguments 200000 random points with 16 dimensions are clustered with 32 clusters.
+"""
+
+code_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(code_path)
+from cluster import kmeans
+
+
+def benchmark_threads(data, clusters, n_threads, seed = 0):
+    '''Clusters the data once with the given number of threads and returns the wall time, labels and centroids'''
+    my_kmeans = kmeans(clusters = clusters, seed = seed)
+    my_kmeans.data = data
+    my_kmeans.n_threads = n_threads
+    start = time.perf_counter()
+    my_kmeans.cluster()
+    wall_time = time.perf_counter() - start
+    return wall_time, my_kmeans.labels, np.array(my_kmeans.centroids), my_kmeans.n_iter
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        data = np.random.default_rng(0).normal(size=(200000, 16))
+        clusters = 32
+    elif len(sys.argv) == 3 and sys.argv[2].isdigit():
+        data = kmeans(sys.argv[1]).data
+        clusters = int(sys.argv[2])
+    else:
+        sys.stderr.write("Usage: bench_threads.py <datafilename> <number of clusters> \n")
+        sys.exit(1)
+    print(f"{os.cpu_count()} cpus, {data.shape[0]} points, {data.shape[1]} dimensions, {clusters} clusters")
+    print("threads\ttime (s)\tspeedup\titerations\tsame result")
+    reference = None
+    for n_threads in (1, 2, 4, 8):
+        wall_time, labels, centroids, iterations = benchmark_threads(data, clusters, n_threads)
+        if reference is None:
+            reference = (wall_time, labels, centroids)
+        same = np.array_equal(labels, reference[1]) and np.array_equal(centroids, reference[2])
+        print(f"{n_threads}\t{wall_time:.3f}\t{reference[0] / wall_time:.2f}\t{iterations}\t{same}")
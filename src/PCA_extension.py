@@ -7,43 +7,154 @@ from cluster import kmeans
 
 """
 This script is an extension of the cluster.py script for better visualization of the clusters.
-The script consists of two functions:
-1. perform_pca(data): This function performs PCA on the given data and returns the result.
-2. plot_pca_with_cluster_colors(kmeans_instance, pca_result): This function plots the data points in the 2D space of the top two principal components with cluster colors.
+The script consists of these functions:
+1. perform_pca(data, n_components=2): This function performs PCA on the given data (or a function that returns a stream of blocks) and returns the result.
+2. fit_pca(data, n_components, method): This function finds the principal components and their explained variance ratios,
+   either by eigendecomposition of the covariance matrix (eigh), randomized truncated SVD for wide data (randomized),
+   or by accumulating the covariance over blocks of rows for data that does not fit in memory (incremental).
+3. transform_pca(data, pca): This function projects the data onto the principal components, one block of rows at a time.
+4. plot_pca_with_cluster_colors(kmeans_instance, pca_result): This function plots the data points in the 2D space of the top two principal components with cluster colors.
 The script takes the following command line arguments:
 1. datafilename: The name of the file containing the data.
 2. number of clusters: The number of clusters to be formed.
 """
 
 
-def perform_pca(data):
-    """This function performs PCA on the given data and returns the result."""
-    # Step 1: Standardize the data
-    mean = np.mean(data, axis=0)
-    std_dev = np.std(data, axis=0)
-    standardized_data = (data - mean) / std_dev
-    # Step 2: Calculate the covariance matrix
-    covariance_matrix = np.cov(standardized_data.T)
-    # Step 3: Calculate the eigenvalues and eigenvectors of the covariance matrix
-    eigenvalues, eigenvectors = np.linalg.eig(covariance_matrix)
-    # Step 4: Sort the eigenvalues and eigenvectors in descending order
-    sorted_indices = np.argsort(eigenvalues)[::-1]
-    sorted_eigenvalues = eigenvalues[sorted_indices]
-    sorted_eigenvectors = eigenvectors[:, sorted_indices]
-    # Step 5: Select the top k eigenvectors
-    top_k_eigenvectors = sorted_eigenvectors[:, :2]
-    # Step 6: Project the data onto the top k eigenvectors
-    pca_result = np.dot(standardized_data, top_k_eigenvectors)
+def _blocks(data, block_rows):
+    """Yields the data in blocks of rows. Arrays (also data on disk) are sliced, any other iterable is assumed to yield blocks."""
+    if hasattr(data, "shape"):
+        for start in range(0, data.shape[0], block_rows):
+            yield np.asarray(data[start:start + block_rows], dtype=np.float64)
+    else:
+        for block in data:
+            yield np.atleast_2d(np.asarray(block, dtype=np.float64))
+
+
+def _moments(data, block_rows):
+    """Accumulates the number of rows, the mean and the covariance matrix (ddof=1) over blocks of rows.
+    The rows are shifted by the first row before the accumulation to avoid cancellation in the sums."""
+    n = 0
+    shift = sums = products = None
+    for block in _blocks(data, block_rows):
+        if shift is None:
+            shift = block[0].copy()
+            sums = np.zeros(block.shape[1])
+            products = np.zeros((block.shape[1], block.shape[1]))
+        shifted = block - shift
+        n += block.shape[0]
+        sums += shifted.sum(axis=0)
+        products += shifted.T @ shifted
+    if n < 2:
+        raise ValueError("PCA needs at least two data points")
+    shifted_mean = sums / n
+    covariance = (products - n * np.outer(shifted_mean, shifted_mean)) / (n - 1)
+    return n, shift + shifted_mean, covariance
+
+
+def _randomized_components(data, mean, std, n_components, seed, oversampling=10, power_iterations=2):
+    """Top principal axes of the standardized data by randomized truncated SVD (Halko et al., 2011).
+    The standardized data is never formed, the products are computed from the raw data, the mean and the standard deviations."""
+    rng = np.random.default_rng(seed)
+    scaled_mean = mean / std
+    # Products with the standardized data Z = (X - mean) / std
+    multiply = lambda matrix: data @ (matrix / std[:, np.newaxis]) - scaled_mean @ matrix
+    multiply_transposed = lambda matrix: (data.T @ matrix - np.outer(mean, matrix.sum(axis=0))) / std[:, np.newaxis]
+    basis, _ = np.linalg.qr(multiply(rng.normal(size=(data.shape[1], n_components + oversampling))))
+    for _ in range(power_iterations):
+        basis, _ = np.linalg.qr(multiply(multiply_transposed(basis)))
+    _, singular_values, right_vectors = np.linalg.svd(multiply_transposed(basis).T, full_matrices=False)
+    return singular_values[:n_components] ** 2 / (data.shape[0] - 1), right_vectors[:n_components].T
+
+
+def fit_pca(data, n_components=2, method="auto", block_rows=4096, seed=0):
+    """Fits PCA on the standardized data and returns a dict with the mean, the standard deviations, the principal axes
+    (components, one per column) and the explained variance and explained variance ratio of each component.
+    data is an array, data on disk (kmeans.load with mmap=True) or an iterable of blocks of rows. The methods are:
+    eigh: eigendecomposition of the covariance matrix of data in memory.
+    randomized: randomized truncated SVD, which avoids the covariance matrix for wide data in memory.
+    incremental: accumulates the mean and covariance over blocks of rows, so the data never has to be in memory.
+    auto: incremental for data that is not an array in memory, randomized for wide data, otherwise eigh.
+    float32 data is not copied to float64 by eigh: its mean and covariance are accumulated in float64 over blocks of rows."""
+    in_memory = isinstance(data, np.ndarray)
+    if method == "auto":
+        if not in_memory:
+            method = "incremental"
+        elif data.shape[1] > 500 and n_components < data.shape[1] // 10:
+            method = "randomized"
+        else:
+            method = "eigh"
+    if method not in ("eigh", "randomized", "incremental"):
+        raise ValueError("Unknown PCA method: " + str(method))
+    if method in ("eigh", "randomized") and not in_memory:
+        raise ValueError("The " + method + " method needs the data in memory")
+    covariance = None
+    if method == "incremental" or (method == "eigh" and data.dtype == np.float32):
+        n, mean, covariance = _moments(data, block_rows)
+        std = np.sqrt(np.maximum(np.diag(covariance), 0) * (n - 1) / n)
+    else:
+        data = np.asarray(data, dtype=np.float64)
+        n = data.shape[0]
+        if n < 2:
+            raise ValueError("PCA needs at least two data points")
+        mean = np.mean(data, axis=0)
+        std = np.std(data, axis=0)
+    dims = len(mean)
+    if not 1 <= n_components <= dims:
+        raise ValueError(f"Number of components must be between 1 and the number of dimensions ({dims})")
+    # Each non-constant standardized column has variance n / (n - 1)
+    total_variance = max(np.count_nonzero(std > 0), 1) * n / (n - 1)
+    # Constant columns are not scaled, they have no variance anyway
+    std = np.where(std > 0, std, 1.0)
+    if method == "randomized":
+        explained_variance, components = _randomized_components(data, mean, std, n_components, seed)
+    else:
+        if covariance is None:
+            centered = data - mean
+            covariance = centered.T @ centered / (n - 1)
+        # Covariance matrix of the standardized data (symmetric, so eigh gives real eigenvalues in ascending order)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance / np.outer(std, std))
+        explained_variance = eigenvalues[::-1][:n_components]
+        components = eigenvectors[:, ::-1][:, :n_components]
+    # Fix the sign of each axis, so the largest loading is positive
+    signs = np.sign(components[np.argmax(np.abs(components), axis=0), np.arange(n_components)])
+    components = components * np.where(signs == 0, 1, signs)
+    return {"mean": mean, "std": std, "components": components, "explained_variance": explained_variance,
+            "explained_variance_ratio": explained_variance / total_variance}
+
+
+def transform_pca(data, pca, block_rows=4096):
+    """Projects the data onto the principal axes of a fitted PCA, one block of rows at a time."""
+    weights = pca["components"] / pca["std"][:, np.newaxis]
+    offset = (pca["mean"] / pca["std"]) @ pca["components"]
+    return np.concatenate([block @ weights - offset for block in _blocks(data, block_rows)])
+
+
+def perform_pca(data, n_components=2, method="auto", return_ratios=False):
+    """This function performs PCA on the given data and returns the result.
+    With return_ratios=True the explained variance ratios of the components are returned as well.
+    The data is read twice (to fit and to project it), so a stream of blocks is given as a function that returns
+    a new iterable of blocks every time it is called, e.g. lambda: read_blocks("data.lst"), or as a list of blocks."""
+    if callable(data):
+        blocks = data
+    elif not hasattr(data, "shape") and iter(data) is data:
+        raise ValueError("perform_pca reads the data twice, so a stream of blocks must be given as a function "
+                         "that returns a new iterable of blocks, e.g. lambda: read_blocks(filename)")
+    else:
+        blocks = lambda: data
+    pca = fit_pca(blocks(), n_components=n_components, method=method)
+    pca_result = transform_pca(blocks(), pca)
+    if return_ratios:
+        return pca_result, pca["explained_variance_ratio"]
     return pca_result
 
 
 def plot_pca_with_cluster_colors(kmeans_instance, pca_result):
     """This function plots the data points in the 2D space of the top two principal components with cluster colors."""
     plt.figure(figsize=(10, 8))
-    for i, key in enumerate(kmeans_instance.cluster_dict.keys()):
-        print(i)
-        cluster_indices = kmeans_instance.cluster_dict[key]
-        plt.scatter(pca_result[cluster_indices, 0], pca_result[cluster_indices, 1], label=key)
+    result = kmeans_instance.result
+    for i in range(len(result.counts)):
+        cluster_indices = result.indices(i)
+        plt.scatter(pca_result[cluster_indices, 0], pca_result[cluster_indices, 1], label="Cluster-" + str(i+1))
     plt.title('PCA with Cluster Colors')
     plt.xlabel('Principal Component 1')
     plt.ylabel('Principal Component 2')
@@ -74,6 +185,7 @@ if __name__ == "__main__":
     my_kmeans.clusters = int(clusters)
     my_kmeans.cluster()
     # Perform PCA
-    pca_result = perform_pca(my_kmeans.data)
+    pca_result, explained_variance_ratio = perform_pca(my_kmeans.data, return_ratios=True)
+    print("Explained variance ratio of the principal components: " + ", ".join(f"{ratio:.3f}" for ratio in explained_variance_ratio))
     # Plot PCA with cluster colors
     plot_pca_with_cluster_colors(my_kmeans, pca_result)
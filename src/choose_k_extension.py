@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import sys
+import numpy as np
+from cluster import kmeans
+
+"""
+This script is an extension of the cluster.py script for choosing the number of clusters (K) automatically.
+The kselector class clusters the data for every candidate K once, caches the results and scores them with:
+1. elbow: the knee of the sum-of-squares curve (the point farthest below the line between its end points).
+2. gap: the gap statistic, which compares the sum-of-squares with the one of uniformly distributed reference data.
+3. silhouette: the mean silhouette score of a random sample of the points.
+The distances for the gap statistic and the silhouette score are computed for samples of the points,
+so the scoring scales to large data sets.
+The script takes the following command line arguments:
+1. datafilename: The name of the file containing the data.
+2. criterion (optional): elbow, gap or silhouette (default).
+"""
+
+
+def _pairwise_distances(points, other_points, block_rows=1024):
+    """Euclidean distances between all points and all other points, computed one block of rows at a time."""
+    other_norms = np.sum(other_points ** 2, axis=1)
+    distances = np.empty((points.shape[0], other_points.shape[0]))
+    for start in range(0, points.shape[0], block_rows):
+        block = points[start:start + block_rows]
+        squared = np.sum(block ** 2, axis=1)[:, np.newaxis] - 2 * block @ other_points.T + other_norms[np.newaxis, :]
+        distances[start:start + block.shape[0]] = np.sqrt(np.maximum(squared, 0))
+    return distances
+
+
+def silhouette_score(points, labels):
+    """Mean silhouette score of the points with the given cluster labels."""
+    clusters = np.unique(labels, return_inverse=True)[1]
+    n_clusters = clusters.max() + 1
+    if n_clusters < 2:
+        return 0.0
+    distances = _pairwise_distances(points, points)
+    # Sum of the distances from each point to the points of each cluster
+    one_hot = np.zeros((len(points), n_clusters))
+    one_hot[np.arange(len(points)), clusters] = 1
+    cluster_sums = distances @ one_hot
+    counts = one_hot.sum(axis=0)
+    own_counts = counts[clusters]
+    # Mean distance to the other points in the same cluster (a) and to the points of the nearest other cluster (b)
+    a = cluster_sums[np.arange(len(points)), clusters] / np.maximum(own_counts - 1, 1)
+    mean_distances = cluster_sums / counts[np.newaxis, :]
+    mean_distances[np.arange(len(points)), clusters] = np.inf
+    b = mean_distances.min(axis=1)
+    scores = np.where(own_counts > 1, (b - a) / np.maximum(np.maximum(a, b), np.finfo(float).tiny), 0.0)
+    return float(np.mean(scores))
+
+
+def knee(K_values, E_values):
+    """Returns the K at the knee of a decreasing sum-of-squares curve: the point farthest below the line between the end points."""
+    K_values = np.asarray(K_values, dtype=np.float64)
+    E_values = np.asarray(E_values, dtype=np.float64)
+    if len(K_values) < 3 or E_values[0] == E_values[-1]:
+        return int(K_values[0])
+    x = (K_values - K_values[0]) / (K_values[-1] - K_values[0])
+    y = (E_values - E_values.min()) / (E_values.max() - E_values.min())
+    return int(K_values[np.argmax((1 - x) - y)])
+
+
+class kselector:
+    """Scores candidate numbers of clusters for the data of a kmeans instance.
+    The clustering for each K is cached, so scoring with another criterion does not cluster the data again."""
+
+    def __init__(self, kmeans_instance, max_clusters=10, n_jobs=1, sample_size=2000, seed=0):
+        self.kmeans = kmeans_instance
+        self.K_values = list(range(1, min(max_clusters, kmeans_instance.data.shape[0]) + 1))
+        self.n_jobs = n_jobs
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        # Every K gets its own seed, so the result for a K does not depend on which other K are clustered with it
+        self.seeds = dict(zip(self.K_values, np.random.SeedSequence(seed).spawn(len(self.K_values))))
+        # Results of kmeans.cluster_many for each K, and the sum-of-squares of the reference data sets for each K
+        self.results = dict()
+        self.reference_E = dict()
+        self._sample = None
+
+    def cluster(self, K_values):
+        """Clusters the data for the values of K that are not cached yet and returns the results for all of them."""
+        missing = [K for K in K_values if K not in self.results]
+        if len(missing) > 0:
+            results = self.kmeans.cluster_many([{"clusters": K} for K in missing], [self.seeds[K] for K in missing], n_jobs=self.n_jobs)
+            self.results.update(zip(missing, results))
+        return [self.results[K] for K in K_values]
+
+    def sample(self):
+        """Indices of the random sample of points used for the gap statistic and the silhouette score."""
+        if self._sample is None:
+            n = self.kmeans.data.shape[0]
+            self._sample = np.sort(self.rng.choice(n, size=min(n, self.sample_size), replace=False))
+        return self._sample
+
+    def elbow_scores(self):
+        """Sum-of-squares for each K."""
+        return {K: result["inertia"] for K, result in zip(self.K_values, self.cluster(self.K_values))}
+
+    def gap_scores(self, n_references=5):
+        """Gap statistic and its standard error for each K. The reference data sets are drawn uniformly
+        from the bounding box of the sample and scaled to the size of the data."""
+        if len(self.reference_E) == 0:
+            points = self.kmeans.data[self.sample()]
+            low, high = points.min(axis=0), points.max(axis=0)
+            reference_kmeans = kmeans(seed=self.rng)
+            for reference in range(n_references):
+                reference_kmeans.data = self.rng.uniform(low, high, size=points.shape)
+                results = reference_kmeans.cluster_many([{"clusters": K} for K in self.K_values], n_jobs=self.n_jobs)
+                for K, result in zip(self.K_values, results):
+                    self.reference_E.setdefault(K, list()).append(result["inertia"])
+        scale = self.kmeans.data.shape[0] / len(self.sample())
+        scores = dict()
+        for K, E in self.elbow_scores().items():
+            log_reference_E = np.log(np.array(self.reference_E[K]) * scale)
+            gap = np.mean(log_reference_E) - np.log(max(E, np.finfo(float).tiny))
+            error = np.std(log_reference_E) * np.sqrt(1 + 1 / len(log_reference_E))
+            scores[K] = (float(gap), float(error))
+        return scores
+
+    def silhouette_scores(self):
+        """Mean silhouette score of the sample for each K above 1."""
+        points = self.kmeans.data[self.sample()]
+        K_values = [K for K in self.K_values if K > 1]
+        return {K: silhouette_score(points, result["labels"][self.sample()]) for K, result in zip(K_values, self.cluster(K_values))}
+
+    def choose(self, criterion="silhouette"):
+        """Returns the chosen number of clusters according to the criterion: elbow, gap or silhouette."""
+        if criterion == "elbow":
+            E_values = self.elbow_scores()
+            return knee(list(E_values.keys()), list(E_values.values()))
+        if criterion == "gap":
+            # The smallest K with gap(K) >= gap(K+1) - s(K+1)
+            scores = self.gap_scores()
+            for K in self.K_values[:-1]:
+                if scores[K][0] >= scores[K + 1][0] - scores[K + 1][1]:
+                    return K
+            return max(scores, key=lambda K: scores[K][0])
+        if criterion == "silhouette":
+            scores = self.silhouette_scores()
+            if len(scores) == 0:
+                return 1
+            return max(scores, key=scores.get)
+        raise ValueError("Unknown criterion: " + str(criterion))
+
+
+def choose_k(kmeans_instance, max_clusters=10, criterion="silhouette", n_jobs=1):
+    """Chooses the number of clusters for the data of the kmeans instance."""
+    return kselector(kmeans_instance, max_clusters=max_clusters, n_jobs=n_jobs).choose(criterion)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        filename = input("Please enter a data file: ")
+        criterion = "silhouette"
+    elif len(sys.argv) == 2:
+        filename = sys.argv[1]
+        criterion = "silhouette"
+    elif len(sys.argv) == 3:
+        filename = sys.argv[1]
+        criterion = sys.argv[2]
+    else:
+        sys.stderr.write("Usage: choose_k_extension.py <datafilename> <elbow|gap|silhouette> \n")
+        sys.exit(1)
+    my_kmeans = kmeans()
+    my_kmeans.load(filename)
+    selector = kselector(my_kmeans)
+    print(selector.choose(criterion))
@@ -2,7 +2,18 @@
 
 import numpy as np
 import sys
+import os
 import re
+import json
+import itertools
+import collections.abc
+import contextlib
+import tempfile
+import shutil
+import concurrent.futures
+import time
+import glob
+import argparse
 
 """
 This is a simple implementation of the k-means algorithm in Python.
@@ -11,12 +22,18 @@ three normal methods: load, cluster, and write. The load method reads data
 from a file and stores it in a numpy array. The cluster method assigns
 data points to clusters using the kmeans algorithm. The write method
 writes the cluster assignments to the chosen output (stdout or new file).
-The class also has four internal methods:
-_euclidian, _pick_centroids_random, _pick_centroids_kmeans_plusplus, and
-_initialise_cluster_dict.
+New points are assigned to the fitted clusters with predict and transform,
+and the fitted model is saved and loaded with save_model and load_model.
+The class also has internal methods for the distance computations
+(_euclidian, _squared_distances, _nearest_centroid), for the initialisation
+of the centroids (_pick_centroids_random, _pick_centroids_kmeans_plusplus,
+_pick_centroids_kmeans_parallel) and for the clustering itself
+(_assign_and_accumulate). The result of the clustering is kept as arrays in
+a kmeans_result, and cluster_dict is a view of it as a dict of lists of indices.
 The class can be used as a standalone script by providing a filename and
-the number of clusters as command-line arguments. The class can also 
-be imported into other scripts and used as a module.
+the number of clusters as command-line arguments, and many files are
+clustered at once with --manifest or --glob (read_manifest, run_batch).
+The class can also be imported into other scripts and used as a module.
 See README.md for more information.
 """
 
@@ -24,241 +41,1789 @@ See README.md for more information.
 # Set seed for reproducibility
 np.random.seed(42)
 
+
+def _check_random_state(seed):
+    '''Turns a seed into a random generator. None gives the global numpy random state seeded above'''
+    if seed is None:
+        return np.random
+    if isinstance(seed, (np.random.Generator, np.random.RandomState)):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def _first_data_line(infile):
+    '''Returns the first line of an open file that is not empty, or an empty string if there is none'''
+    first_line = infile.readline()
+    while first_line and not first_line.strip():
+        first_line = infile.readline()
+    return first_line
+
+
+def _detect_format(first_line):
+    '''Detects the delimiter, whether there is an id column and the number of dimensions from the first line of a .lst file'''
+    line = first_line.split()
+    delimiter = None
+    # Handling case where not tab seperated, but comma seperated
+    if len(line) < 2:
+        line = line[0].split(",")
+        delimiter = ","
+    # If the first element is a string, it is an id
+    has_id = re.search(r'[A-Za-z]+', line[0]) is not None
+    dims = len(line) - 1 if has_id else len(line)
+    return delimiter, has_id, dims
+
+
+def _parse_lines(source, delimiter, has_id, dims, dtype = np.float64):
+    '''Parses a .lst file (or a list of its lines) in one go into an array of dtype (float64 or float32) and a list of ids.
+    The values are parsed directly into dtype, so no float64 copy or list of rows is made for float32'''
+    # Ids are read as fixed width strings, if the longest id fills the width it might be truncated and the lines are parsed again
+    id_width = 16
+    while True:
+        try:
+            if has_id:
+                table = np.loadtxt(source, delimiter=delimiter, ndmin=1,
+                                   dtype=[("id", f"U{id_width}"), ("vector", dtype, (dims,))])
+                if len(table) > 0 and np.max(np.char.str_len(table["id"])) >= id_width:
+                    id_width *= 4
+                    continue
+                data = np.ascontiguousarray(table["vector"]).reshape(len(table), dims)
+                ids = table["id"].tolist()
+            else:
+                data = np.loadtxt(source, delimiter=delimiter, ndmin=2, dtype=dtype)
+                ids = list()
+        except ValueError as err:
+            # The parser reports rows with a different number of columns than the first one
+            if "columns" in str(err):
+                raise ValueError("Inconsistent vector dimensions") from err
+            raise
+        return data, ids
+
+
+def _read_blocks(infile, delimiter, has_id, dims, block_rows, dtype = np.float64):
+    '''Yields the data (as dtype) and ids of an open .lst file in blocks of at most block_rows lines'''
+    while True:
+        block = list(itertools.islice(infile, block_rows))
+        if len(block) == 0:
+            break
+        # Skip empty lines
+        lines = [line for line in block if line.strip()]
+        if len(lines) > 0:
+            yield _parse_lines(lines, delimiter, has_id, dims, dtype)
+
+
+def read_blocks(filename, block_rows = 4096, dtype = np.float64):
+    '''Yields the data of a .lst file as arrays of dtype (float64 or float32) of at most block_rows rows, without reading the whole file.
+    A missing file raises FileNotFoundError'''
+    with open(filename, "r") as infile:
+        first_line = _first_data_line(infile)
+        if not first_line:
+            raise ValueError("File is empty")
+        delimiter, has_id, dims = _detect_format(first_line)
+        infile.seek(0)
+        for data, ids in _read_blocks(infile, delimiter, has_id, dims, block_rows, dtype):
+            yield data
+
+
+def _rebatch(blocks, batch_size, dtype = np.float64):
+    '''Turns an iterable of blocks of rows of any size into batches of batch_size rows (the last one may be smaller) of dtype'''
+    pending = list()
+    pending_rows = 0
+    for block in blocks:
+        block = np.asarray(block, dtype=dtype)
+        if block.ndim == 1:
+            block = block[np.newaxis, :]
+        pending.append(block)
+        pending_rows += block.shape[0]
+        while pending_rows >= batch_size:
+            rows = np.concatenate(pending)
+            yield rows[:batch_size]
+            pending = [rows[batch_size:]]
+            pending_rows -= batch_size
+    if pending_rows > 0:
+        yield np.concatenate(pending)
+
+
+def _read_cache(filename, source_stat, dtype = np.float64):
+    '''Returns the data and ids from the .npz sidecar of filename if it matches the size and modification time of the file
+    and holds the data as dtype'''
+    try:
+        with np.load(filename + ".npz", allow_pickle=False) as cache:
+            if cache["source_size"] != source_stat.st_size or cache["source_mtime"] != source_stat.st_mtime_ns:
+                return None
+            if cache["data"].dtype != dtype:
+                return None
+            return cache["data"], cache["ids"].tolist()
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_cache(filename, source_stat, data, ids):
+    '''Saves the data and ids in a .npz sidecar next to filename'''
+    try:
+        with open(filename + ".npz", "wb") as cache:
+            np.savez(cache, data=data, ids=np.array(ids, dtype=str), 
+                     source_size=source_stat.st_size, source_mtime=source_stat.st_mtime_ns)
+    except OSError as err:
+        # The cache is only an optimisation, so the data is still usable if it cannot be written
+        sys.stderr.write("Could not write cache file: " + str(err) + "\n")
+
+
+def _format_rows(rows, ids=None):
+    '''Formats a block of data points as tab separated lines, optionally starting with the ids.
+    The block is converted to Python floats at once, whose str() is the same text as str() of a numpy float64.
+    Float32 rows are converted with numpy, which gives the shortest text of the float32 value instead of the float64 one'''
+    if rows.dtype == np.float32:
+        rows = rows.astype(str)
+    lines = ["\t".join(map(str, row)) for row in rows.tolist()]
+    if ids is not None:
+        lines = [point_id + "\t" + line for point_id, line in zip(ids.tolist(), lines)]
+    return "".join([line + "\n" for line in lines])
+
+
+# Output formats chosen from the extension of the outfile in kmeans.write
+_WRITE_FORMATS = {".npz": "npz", ".cols": "columns"}
+
+_COLUMNS_MAGIC = b"KMEANS-COLUMNS 1\n"
+
+# Stage timer used when the instrumentation is turned off
+_NO_TIMER = contextlib.nullcontext()
+
+# Number of formatted characters collected in memory before they are appended to the temporary files of the clusters,
+# when the text layout of data on disk is written
+_SPILL_CHARACTERS = 1 << 24
+
+
+def write_columns(filename, columns):
+    '''Writes a dictionary of arrays to a columns file: a magic line, a JSON line describing the name,
+    dtype and shape of every column, and then the raw bytes of the columns in the same order'''
+    columns = {name: np.ascontiguousarray(column) for name, column in columns.items()}
+    header = [{"name": name, "dtype": column.dtype.str, "shape": list(column.shape)} for name, column in columns.items()]
+    with open(filename, "wb") as outfile:
+        outfile.write(_COLUMNS_MAGIC)
+        outfile.write(json.dumps(header).encode() + b"\n")
+        for column in columns.values():
+            outfile.write(column.tobytes())
+
+
+def read_columns(filename):
+    '''Reads a columns file written by write_columns and returns a dictionary of arrays'''
+    with open(filename, "rb") as infile:
+        if infile.readline() != _COLUMNS_MAGIC:
+            raise ValueError(filename + " is not a columns file")
+        header = json.loads(infile.readline())
+        columns = {}
+        for column in header:
+            dtype = np.dtype(column["dtype"])
+            count = int(np.prod(column["shape"], dtype=np.int64))
+            columns[column["name"]] = np.fromfile(infile, dtype=dtype, count=count).reshape(column["shape"])
+            if columns[column["name"]].size != count:
+                raise ValueError(filename + " is truncated")
+    return columns
+
+
+class _DiskArray:
+    '''A read-only array stored in a .npy file. Rows are read through a memory map of only the requested rows,
+    so the whole file is never mapped or loaded at once and memory use is set by the size of the requested blocks'''
+
+    def __init__(self, path):
+        with open(path, "rb") as infile:
+            version = np.lib.format.read_magic(infile)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(infile)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(infile)
+            self.offset = infile.tell()
+        if fortran_order:
+            raise ValueError("Arrays in Fortran order are not supported")
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.ndim = len(shape)
+        self.size = int(np.prod(shape))
+        self.row_bytes = dtype.itemsize * int(np.prod(shape[1:]))
+        # A file that was not written to the end (e.g. an interrupted conversion) cannot be memory mapped
+        if os.path.getsize(path) < self.offset + self.size * dtype.itemsize:
+            raise ValueError(path + " is shorter than its header says, it might be truncated")
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _rows(self, start, stop):
+        '''Memory maps the rows from start to stop'''
+        if stop <= start:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.offset + start * self.row_bytes,
+                         shape=(stop - start,) + self.shape[1:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self._rows(start, stop)[::step] if step != 1 else self._rows(start, stop)
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("index out of range")
+            return np.array(self._rows(index, index + 1)[0])
+        # An array of indices, each row is read on its own
+        index = np.asarray(index)
+        rows = np.empty(index.shape + self.shape[1:], dtype=self.dtype)
+        for position, row_index in enumerate(index.ravel()):
+            rows.reshape((-1,) + self.shape[1:])[position] = self[int(row_index)]
+        return rows
+
+    def __array__(self, dtype=None, copy=None):
+        # Loads the whole array into memory, only meant for data that fits in memory
+        data = np.load(self.path)
+        return data if dtype is None else data.astype(dtype)
+
+
+def _open_disk_array(filename, block_rows, dtype = np.float64):
+    '''Opens the data (and ids) of filename as arrays on disk. Text files are converted to a .npy file of dtype first,
+    which is reused as long as it is newer than the text file and has the same dtype. A .npy file is used with its own dtype'''
+    if filename.endswith(".npy"):
+        data_path = filename
+        ids_path = filename[:-len(".npy")] + ".ids.npy"
+    else:
+        data_path = filename + ".npy"
+        ids_path = filename + ".ids.npy"
+        try:
+            up_to_date = os.path.getmtime(data_path) >= os.path.getmtime(filename) and _DiskArray(data_path).dtype == dtype
+        except (FileNotFoundError, ValueError):
+            up_to_date = False
+        if not up_to_date:
+            _convert_to_npy(filename, data_path, ids_path, block_rows, dtype)
+    try:
+        data = _DiskArray(data_path)
+    except FileNotFoundError:
+        print("Datafile not found. Please provide a valid filename.")
+        sys.exit(1)
+    if data.size == 0:
+        raise ValueError("File is empty")
+    if os.path.exists(ids_path) and os.path.getmtime(ids_path) >= os.path.getmtime(data_path):
+        ids = _DiskArray(ids_path)
+    else:
+        ids = list()
+    return data, ids
+
+
+def _convert_to_npy(filename, data_path, ids_path, block_rows, dtype = np.float64):
+    '''Converts a .lst file to a .npy file with the data (as dtype) and a .npy file with the ids, one block of lines at a time'''
+    try:
+        infile = open(filename, "r")
+    except FileNotFoundError:
+        print("Datafile not found. Please provide a valid filename.")
+        sys.exit(1)
+    # First pass: count the data lines and find the longest id
+    first_line = None
+    rows = 0
+    id_width = 1
+    for line in infile:
+        if not line.strip():
+            continue
+        if first_line is None:
+            first_line = line
+            delimiter, has_id, dims = _detect_format(first_line)
+        rows += 1
+        if has_id:
+            id_width = max(id_width, len(line.split(delimiter, 1)[0].strip()))
+    if first_line is None:
+        infile.close()
+        raise ValueError("File is empty")
+    # Second pass: parse blocks of lines and append them to temporary binary files, which only replace
+    # the .npy files when the whole file is converted, so a failed conversion never leaves a partial file behind
+    infile.seek(0)
+    data_temporary = data_path + ".tmp"
+    ids_temporary = ids_path + ".tmp"
+    try:
+        with open(data_temporary, "wb") as data_out:
+            np.lib.format.write_array_header_1_0(data_out, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                            "fortran_order": False, "shape": (rows, dims)})
+            ids_out = None
+            if has_id:
+                ids_out = open(ids_temporary, "wb")
+                np.lib.format.write_array_header_1_0(ids_out, {"descr": np.lib.format.dtype_to_descr(np.dtype(f"U{id_width}")),
+                                                               "fortran_order": False, "shape": (rows,)})
+            try:
+                for data, ids in _read_blocks(infile, delimiter, has_id, dims, block_rows, dtype):
+                    data_out.write(data.tobytes())
+                    if has_id:
+                        ids_out.write(np.array(ids, dtype=f"U{id_width}").tobytes())
+            finally:
+                # The data is flushed before the ids are closed, so the ids are not older than the data
+                data_out.flush()
+                if ids_out is not None:
+                    ids_out.close()
+        # The ids are replaced first, as they are only used if they are at least as new as the data
+        if has_id:
+            os.replace(ids_temporary, ids_path)
+        os.replace(data_temporary, data_path)
+    finally:
+        infile.close()
+        for temporary in (data_temporary, ids_temporary):
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+
+def _spawn_seeds(seed, n):
+    '''Makes n independent seeds from one seed. None draws the root seed from the global numpy random state'''
+    if isinstance(seed, np.random.SeedSequence):
+        return seed.spawn(n)
+    if seed is None:
+        seed = np.random.randint(2**31)
+    elif isinstance(seed, (np.random.Generator, np.random.RandomState)):
+        seed = int(seed.integers(2**63)) if isinstance(seed, np.random.Generator) else int(seed.randint(2**31))
+    return np.random.SeedSequence(seed).spawn(n)
+
+
+@contextlib.contextmanager
+def _shared_data(data):
+    '''Gives the path of a .npy file with the data that worker processes can memory map, so the data is not copied to each of them.
+    Data in memory is written once to a temporary file in shared memory (/dev/shm) if available'''
+    if isinstance(data, _DiskArray):
+        yield data.path, True
+        return
+    temporary_dir = tempfile.mkdtemp(dir = "/dev/shm" if os.path.isdir("/dev/shm") else None)
+    try:
+        data_path = os.path.join(temporary_dir, "data.npy")
+        np.save(data_path, data)
+        yield data_path, False
+    finally:
+        shutil.rmtree(temporary_dir, ignore_errors = True)
+
+
+def _open_shared_data(data_path, on_disk):
+    '''Opens the data written by _shared_data in a worker process'''
+    if on_disk:
+        return _DiskArray(data_path)
+    return np.load(data_path, mmap_mode = "r")
+
+
+def _fit_restart(data, settings, seed):
+    '''Clusters the data once with the given settings and seed and returns the result as a dict'''
+    my_kmeans = kmeans(seed = seed)
+    for name, value in settings.items():
+        setattr(my_kmeans, name, value)
+    my_kmeans.data = data
+    labels, centroids, inertia = my_kmeans._fit()
+    return {"labels": labels, "centroids": np.array(centroids), "inertia": inertia,
+            "n_iter": my_kmeans.n_iter, "distance_evaluations": my_kmeans.distance_evaluations,
+            "skipped_distances": my_kmeans.skipped_distances,
+            "bound_evaluations": my_kmeans.bound_evaluations, "iteration_times": my_kmeans.iteration_times,
+            "inertia_history": my_kmeans.inertia_history}
+
+
+def _fit_restart_worker(task):
+    '''Entry point of the worker processes: opens the shared data and clusters it once'''
+    data_path, on_disk, settings, seed = task
+    return _fit_restart(_open_shared_data(data_path, on_disk), settings, seed)
+
+
+class _HamerlyBounds:
+    '''Assignment step of Hamerly's algorithm. Keeps an upper bound on the distance from each point to its centroid
+    and one lower bound on the distance to all other centroids. Points whose upper bound is below the lower bound
+    (or half the distance from their centroid to the nearest other centroid) cannot change cluster and are skipped'''
+
+    def __init__(self, kmeans_instance):
+        self.kmeans = kmeans_instance
+        self.centroids = None
+        self.labels = None
+        self.upper = None
+        self.lower = None
+        self.evaluations = 0
+        # Distances from points to their own centroid computed to tighten the upper bounds
+        self.tightenings = 0
+
+    def _closest_two(self, block, centroids, block_norms):
+        '''Labels, distance to the closest and distance to the second closest centroid for every point in the block'''
+        distances = self.kmeans._squared_distances(block, centroids, block_norms)
+        labels = np.argmin(distances, axis=1)
+        closest = np.sqrt(distances[np.arange(len(labels)), labels])
+        if centroids.shape[0] == 1:
+            second = np.full(len(labels), np.inf)
+        else:
+            second = np.sqrt(np.partition(distances, 1, axis=1)[:, 1])
+        return labels, closest, second
+
+    def assign(self, centroids):
+        '''Assigns every data point to its nearest centroid and sums up the points of each cluster'''
+        n, dims = self.kmeans.data.shape
+        k = centroids.shape[0]
+        sums = np.zeros(shape=(k, dims), dtype=np.float64)
+        counts = np.zeros(k, dtype=np.int64)
+        if self.labels is None:
+            self.labels = np.empty(n, dtype=np.int32)
+            self.upper = np.empty(n, dtype=np.float64)
+            self.lower = np.empty(n, dtype=np.float64)
+        else:
+            # Move the bounds by how far the centroids moved
+            shifts = np.sqrt(np.sum((centroids - self.centroids) ** 2, axis=1))
+            self.upper += shifts[self.labels]
+            largest = np.argmax(shifts)
+            second_largest = np.max(np.delete(shifts, largest)) if k > 1 else 0.0
+            self.lower -= np.where(self.labels == largest, second_largest, shifts[largest])
+            separation = np.sqrt(self.kmeans._squared_distances(centroids, centroids))
+            np.fill_diagonal(separation, np.inf)
+            half_separation = 0.5 * np.min(separation, axis=1)
+        def assign_block(start, block):
+            # A block only writes its own rows of the bounds and returns its counts, so the blocks can run in threads
+            rows = slice(start, start + block.shape[0])
+            labels, upper, lower = self.labels[rows], self.upper[rows], self.lower[rows]
+            norms = self.kmeans._block_norms(start, block)
+            evaluations = tightenings = 0
+            if self.centroids is None:
+                labels[:], upper[:], lower[:] = self._closest_two(block, centroids, norms)
+                evaluations += block.shape[0] * k
+            else:
+                bound = np.maximum(half_separation[labels], lower)
+                check = np.flatnonzero(upper > bound)
+                if len(check) > 0:
+                    # Tighten the upper bound, only the points that still fail the test need all distances
+                    upper[check] = np.sqrt(np.sum((block[check] - centroids[labels[check]]) ** 2, axis=1))
+                    tightenings += len(check)
+                    check = check[upper[check] > bound[check]]
+                if len(check) > 0:
+                    check_norms = None if norms is None else norms[check]
+                    labels[check], upper[check], lower[check] = self._closest_two(block[check], centroids, check_norms)
+                    evaluations += len(check) * k
+            block_sums, block_counts = self.kmeans._block_sums(block, labels)
+            return block_sums, block_counts, evaluations, tightenings
+        for block_sums, block_counts, evaluations, tightenings in self.kmeans._map_blocks(assign_block):
+            sums += block_sums
+            counts += block_counts
+            self.evaluations += evaluations
+            self.tightenings += tightenings
+        self.centroids = centroids
+        return self.labels.copy(), sums, counts
+
+
+class _ElkanBounds:
+    '''Assignment step of Elkan's algorithm. Keeps an upper bound on the distance from each point to its centroid
+    and a lower bound on the distance to every centroid, and uses the distances between the centroids
+    to skip every point-centroid distance that cannot change the assignment'''
+
+    def __init__(self, kmeans_instance):
+        self.kmeans = kmeans_instance
+        self.centroids = None
+        self.labels = None
+        self.upper = None
+        self.lower = None
+        self.evaluations = 0
+        # Distances from points to their own centroid computed to tighten the upper bounds
+        self.tightenings = 0
+
+    def assign(self, centroids):
+        '''Assigns every data point to its nearest centroid and sums up the points of each cluster'''
+        n, dims = self.kmeans.data.shape
+        k = centroids.shape[0]
+        sums = np.zeros(shape=(k, dims), dtype=np.float64)
+        counts = np.zeros(k, dtype=np.int64)
+        if self.labels is None:
+            self.labels = np.empty(n, dtype=np.int32)
+            self.upper = np.empty(n, dtype=np.float64)
+            self.lower = np.empty(shape=(n, k), dtype=np.float64)
+        else:
+            # Move the bounds by how far the centroids moved
+            shifts = np.sqrt(np.sum((centroids - self.centroids) ** 2, axis=1))
+            self.upper += shifts[self.labels]
+            self.lower -= shifts
+            np.maximum(self.lower, 0, out=self.lower)
+            half_distances = 0.5 * np.sqrt(self.kmeans._squared_distances(centroids, centroids))
+            separation = half_distances.copy()
+            np.fill_diagonal(separation, np.inf)
+            half_separation = np.min(separation, axis=1)
+        def assign_block(start, block):
+            # A block only writes its own rows of the bounds and returns its counts, so the blocks can run in threads
+            rows = slice(start, start + block.shape[0])
+            labels, upper, lower = self.labels[rows], self.upper[rows], self.lower[rows]
+            evaluations = tightenings = 0
+            if self.centroids is None:
+                distances = self.kmeans._squared_distances(block, centroids, self.kmeans._block_norms(start, block))
+                evaluations += distances.size
+                lower[:] = np.sqrt(distances)
+                labels[:] = np.argmin(distances, axis=1)
+                upper[:] = lower[np.arange(len(labels)), labels]
+            else:
+                check = np.flatnonzero(upper > half_separation[labels])
+                tight = np.zeros(block.shape[0], dtype=bool)
+                for j in range(k):
+                    # Points that might be closer to centroid j than to their own centroid
+                    candidates = check[(labels[check] != j) & (upper[check] > lower[check, j]) & (upper[check] > half_distances[labels[check], j])]
+                    loose = candidates[~tight[candidates]]
+                    if len(loose) > 0:
+                        # Tighten the upper bound and test again
+                        distances = np.sqrt(np.sum((block[loose] - centroids[labels[loose]]) ** 2, axis=1))
+                        tightenings += len(loose)
+                        upper[loose] = distances
+                        lower[loose, labels[loose]] = distances
+                        tight[loose] = True
+                        candidates = candidates[(upper[candidates] > lower[candidates, j]) & (upper[candidates] > half_distances[labels[candidates], j])]
+                    if len(candidates) == 0:
+                        continue
+                    distances = np.sqrt(np.sum((block[candidates] - centroids[j]) ** 2, axis=1))
+                    evaluations += len(candidates)
+                    lower[candidates, j] = distances
+                    closer = distances < upper[candidates]
+                    labels[candidates[closer]] = j
+                    upper[candidates[closer]] = distances[closer]
+            block_sums, block_counts = self.kmeans._block_sums(block, labels)
+            return block_sums, block_counts, evaluations, tightenings
+        for block_sums, block_counts, evaluations, tightenings in self.kmeans._map_blocks(assign_block):
+            sums += block_sums
+            counts += block_counts
+            self.evaluations += evaluations
+            self.tightenings += tightenings
+        self.centroids = centroids
+        return self.labels.copy(), sums, counts
+
+
+def _is_count(value):
+    '''True for an integer above 0'''
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+# Check of the value of every setting that save_model writes (the settings of kmeans._settings, except an array as init)
+_MODEL_SETTINGS = {"clusters": _is_count,
+                   "init": lambda value: value in ("k-means++", "k-means||", "random"),
+                   "algorithm": lambda value: value in ("lloyd", "hamerly", "elkan", "minibatch"),
+                   "chunk_size": _is_count,
+                   "n_threads": lambda value: value is None or (isinstance(value, int) and not isinstance(value, bool)),
+                   "batch_size": _is_count,
+                   "max_iter": _is_count,
+                   "tol": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0,
+                   "convergence": lambda value: value in ("shift", "inertia"),
+                   "dtype": lambda value: value in ("float64", "float32")}
+
+
+class kmeans_result:
+    '''The result of a clustering stored as arrays: the cluster label (int32) of every point, the centroids (float64),
+    the number of points in each cluster and the inertia (sum-of-squares). The indices of the points in each cluster
+    are found with indices(i), which uses the indices sorted by cluster and the offsets of each cluster in them (as in CSR)'''
+
+    def __init__(self, labels, centroids, inertia = None):
+        self.labels = np.asarray(labels, dtype = np.int32)
+        self.centroids = np.asarray(centroids, dtype = np.float64)
+        self.counts = np.bincount(self.labels, minlength = len(self.centroids))
+        self.inertia = inertia
+        self._order = None
+
+    @property
+    def order(self):
+        '''Indices of the points sorted by cluster, points of the same cluster in the order of the data'''
+        if self._order is None:
+            self._order = np.argsort(self.labels, kind = "stable")
+        return self._order
+
+    @property
+    def offsets(self):
+        '''Start of each cluster in order, the indices of cluster i are order[offsets[i]:offsets[i+1]]'''
+        return np.concatenate([[0], np.cumsum(self.counts)])
+
+    def indices(self, i):
+        '''Indices of the points in cluster i (counting from 0)'''
+        offsets = self.offsets
+        return self.order[offsets[i]:offsets[i + 1]]
+
+    @property
+    def cluster_dict(self):
+        return _ClusterDictView(self)
+
+
+class _ClusterDictView(collections.abc.Mapping):
+    '''Read-only view of a kmeans_result as the dict of "Cluster-<number>": list of indices used before.
+    The lists are only made when a cluster is looked up'''
+
+    def __init__(self, result):
+        self.result = result
+
+    def __getitem__(self, key):
+        if not isinstance(key, str) or not key.startswith("Cluster-") or not key[8:].isdigit():
+            raise KeyError(key)
+        i = int(key[8:]) - 1
+        if not 0 <= i < len(self.result.counts):
+            raise KeyError(key)
+        return self.result.indices(i).tolist()
+
+    def __iter__(self):
+        return ("Cluster-" + str(i+1) for i in range(len(self.result.counts)))
+
+    def __len__(self):
+        return len(self.result.counts)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class kmeans:
     
     # Initialise the class with the filename and the amount of clusters and needed data structures
-    def __init__(self, filename = None, clusters = None):
+    def __init__(self, filename = None, clusters = None, seed = None, init = "k-means++", algorithm = "lloyd", dtype = "float64"):
         self.data = np.array([])
-        self.vector_list = list()
+        # Type of the loaded data: "float64" or "float32", which halves the memory and speeds up the distance computations.
+        # Sums, norms, centroids and inertia are always computed in float64
+        self.dtype = dtype
         self.ids = list()
         self.clusters = None
-        self.cluster_dict = dict()
+        # Result of the last clustering (labels, centroids, counts and inertia as arrays), see kmeans_result
+        self.result = None
         self.centroids = None
+        self.labels = None
+        # Seed (int, SeedSequence or numpy Generator) for the initialisation, None uses the global numpy random state
+        self.seed = seed
+        # Initialisation of the centroids: "k-means++", "k-means||", "random" or an array with the initial centroids
+        self.init = init
+        # Number of rows processed at a time when computing distances, and number of threads
+        # processing the blocks of rows in parallel (None or -1 uses all cpus)
+        self.chunk_size = 4096
+        self.n_threads = 1
+        # Pool of threads shared by every block operation of a fit
+        self._pool = None
+        # Squared norms of the data points during a fit
+        self._norms = None
+        # Clustering algorithm: "lloyd" (full batch), "hamerly" or "elkan" (full batch with distance bounds) or "minibatch"
+        self.algorithm = algorithm
+        # Rows per batch of the mini-batch algorithm
+        self.batch_size = 1024
+        # Convergence: maximum number of iterations (or mini-batches) and tolerance for stopping early.
+        # With convergence "shift" the clustering stops when the squared shift of the centroids falls below tol times
+        # the mean variance of the data, with "inertia" when the inertia changes by less than a fraction tol.
+        # The full batch algorithms also stop when no point changes cluster
+        self.max_iter = 200
+        self.tol = 1e-4
+        self.convergence = "shift"
+        # Number of iterations (or mini-batches) of the last clustering, the time of every iteration
+        # and the inertia of every iteration (of the centroids the points were assigned to) of the full batch algorithms
+        self.n_iter = None
+        self.iteration_times = list()
+        self.inertia_history = list()
+        # Instrumentation: with instrument=True the time of each stage (load, seed, cluster, write), the iterations,
+        # distance computations and bytes read and written are added up in self.stats (see reset_stats).
+        # callback(iteration, inertia, shift) is called after every iteration if it is given
+        self.instrument = False
+        self.callback = None
+        self.stats = dict()
+        # Number of point-centroid distances computed and skipped in the assignment steps of the last full batch clustering
+        # The skipped distances are the point-centroid pairs that were never computed in the assignment steps, and the
+        # bound evaluations are the extra distances Hamerly's and Elkan's algorithms compute to tighten their upper bounds
+        self.distance_evaluations = None
+        self.skipped_distances = None
+        self.bound_evaluations = None
+        # Number of runs from different seeds (the best one is kept) and number of processes used for them
+        # (None or -1 uses all cpus). The inertia and number of iterations of every run are found in self.restarts
+        self.n_init = 1
+        self.n_jobs = 1
+        self.inertia = None
+        self.restarts = list()
+        # Online clustering with partial_fit: weight kept by the earlier points for every new batch (1 keeps them all)
+        # and number of batches between reports of the drift of the centroids on stderr (None for no reports)
+        self.decay = 1.0
+        self.drift_interval = None
+        self.n_batches = 0
+        self.drift = None
+        # Sums and (decayed) numbers of the points of every cluster and the centroids the drift is measured from
+        self._sums = None
+        self._counts = None
+        self._reference = None
         if filename is not None:
             self.load(filename)
         if clusters is not None:
             self.clusters = clusters
 
 
-    def load(self, filename):
-        """Reads data from a .lst file and stores it in a numpy array"""
-        self.vector_list.clear()
-        self.ids.clear()
+    @property
+    def vector_list(self):
+        '''The loaded vectors. Kept for backwards compatibility, the data is only stored once in self.data'''
+        return self.data
+
+
+    def _timer(self, stage):
+        '''Context manager that adds the time spent in it to the timer of the stage in self.stats.
+        Without instrumentation it is a context manager that does nothing'''
+        if not self.instrument:
+            return _NO_TIMER
+        return self._timed(stage)
+
+
+    @contextlib.contextmanager
+    def _timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timers = self.stats.setdefault("timers", dict())
+            timers[stage] = timers.get(stage, 0.0) + time.perf_counter() - start
+
+
+    def _count(self, name, value):
+        '''Adds value to the counter name in self.stats'''
+        self.stats[name] = self.stats.get(name, 0) + value
+
+
+    def reset_stats(self):
+        '''Clears the statistics collected with instrument=True'''
+        self.stats = dict()
+
+
+    def stats_json(self):
+        '''The statistics collected with instrument=True as a JSON string'''
+        return json.dumps(self.stats, indent=2)
+
+
+    def load(self, filename, cache = False, mmap = False):
+        """Reads data from a .lst file and stores it in a numpy array of self.dtype (float64 or float32).
+        With cache=True the parsed data and ids are saved in a <filename>.npz sidecar,
+        which is used by later loads as long as the size and modification time of the file are unchanged.
+        With mmap=True the data stays on disk: the file is converted to <filename>.npy (and <filename>.ids.npy),
+        or used directly if it already is a .npy file, and is only read one chunk at a time"""
+        with self._timer("load"):
+            self._load(filename, cache, mmap)
+        if self.instrument:
+            self._count("bytes_read", os.path.getsize(filename))
+        return self.data, self.ids
+
+
+    def _load(self, filename, cache, mmap):
+        '''Reads the data and ids of filename into self.data and self.ids, see load'''
+        dtype = self._data_dtype()
+        if mmap:
+            self.data, self.ids = _open_disk_array(filename, self.chunk_size, dtype)
+            return self.data, self.ids
         try:
             infile = open(filename, "r")
-            # Check if the file is empty
-            first_line = infile.readline()
-            if not first_line:
-                raise ValueError("File is empty") 
-            # Reset the file pointer to the beginning of the file if it is not empty
-            infile.seek(0)
+            # Find the first line with data to detect the format of the file
+            first_line = _first_data_line(infile)
+            infile.close()
+            source_stat = os.stat(filename)
         except FileNotFoundError:
             print("Datafile not found. Please provide a valid filename.")
             sys.exit(1)
         except IOError as err:
             print(err)
             sys.exit(1)
-        # Read the file and store the data (ids and coordinates/vector) in a list of lists
-        previous_vector = None
-        for line in infile:
-            line = line.split()
-            # Skip empty lines
-            if len(line) == 0:
-                continue
-            # Handling case where not tap seperated, but comma seperated
-            if len(line) < 2:
-                line = line[0].split(",")
-            if re.search(r'[A-Za-z]+', line[0]):
-                # If the first element is a string, it is an id
-                vector = [float(n) for n in line[1:]]
-                self.ids.append(line[0])
-            else:
-                # If the first element is a number, there is no id
-                vector = [float(n) for n in line[:]]
-            # Check if dimensions are consistent
-            if previous_vector is not None and len(vector) != previous_vector:
-                raise ValueError("Inconsistent vector dimensions")
-            previous_vector = len(vector)
-            # Append the vector to the list of vectors
-            self.vector_list.append(vector)
-        infile.close()
-        # Convert the list of lists to a numpy array
-        cols = len(self.vector_list[0])
-        rows = len(self.vector_list)
-        self.data = np.empty(shape=(rows, cols), dtype=np.float64)
-        for i in range(len(self.vector_list)):
-            self.data[i] = self.vector_list[i]
+        # Check if the file is empty
+        if not first_line:
+            raise ValueError("File is empty")
+        if cache:
+            cached = _read_cache(filename, source_stat, dtype)
+            if cached is not None:
+                self.data, self.ids = cached
+                return self.data, self.ids
+        delimiter, has_id, dims = _detect_format(first_line)
+        self.data, self.ids = _parse_lines(filename, delimiter, has_id, dims, dtype)
+        if cache:
+            _write_cache(filename, source_stat, self.data, self.ids)
         return self.data, self.ids
 
 
+    def _data_dtype(self):
+        '''self.dtype as a numpy dtype, error handling to make sure that it is float64 or float32'''
+        if str(self.dtype) not in ("float64", "float32"):
+            raise ValueError("Unknown dtype: " + str(self.dtype) + ". Please use float64 or float32")
+        return np.dtype(self.dtype)
+
+
     def _euclidian(self, v, u):
         '''Calculate the euclidian distance between two vectors'''
         squared_diff = (v - u) ** 2
         distance = np.sqrt(np.sum(squared_diff))
         return distance
     
-    def _pick_centroids_random(self):
+    def _pick_centroids_random(self, rng=np.random):
         '''Select the initial centroids randomly'''
-        centroid_ids = np.random.choice(self.data.shape[0], size = self.clusters, replace = False)
+        centroid_ids = rng.choice(self.data.shape[0], size = self.clusters, replace = False)
         initial_centroids = [self.data[i] for i in centroid_ids]
         return initial_centroids
     
 
-    def _pick_centroids_kmeans_plusplus(self):
+    def _pick_centroids_kmeans_plusplus(self, rng=np.random):
         """Selects the initial centroids using the K-means++ algorithm"""
+        n = self.data.shape[0]
         # Randomly select the first centroid
-        centroid_indices = [np.random.randint(self.data.shape[0])]
+        centroid_indices = [rng.choice(n)]
+        # Squared distance from each data point to its nearest chosen centroid, updated with every new centroid
+        min_distances = self._nearest_centroid(self.data[centroid_indices[0]][np.newaxis, :])[1]
         # Choose subsequent centroids using K-means++ algorithm until the desired amount of centroids is reached
         while len(centroid_indices) < self.clusters:
-            # Calculate distances from each data point to the nearest centroid
-            distances = list()
-            for i in range(self.data.shape[0]):
-                min_distance = sys.float_info.max
-                for centroid_index in centroid_indices:
-                    distance = self._euclidian(self.data[i], self.data[centroid_index])
-                    min_distance = min(min_distance, distance)
-                distances.append(min_distance)
             # Calculate the probability of each data point being selected as the next centroid
-            probabilities = np.array(distances) ** 2
-            probabilities /= np.sum(probabilities)
+            total = np.sum(min_distances)
+            if total > 0:
+                probabilities = min_distances / total
+            else:
+                # All points coincide with a centroid, so pick uniformly
+                probabilities = None
             # Select the next centroid based on the calculated probability distribution
-            new_centroid_index = np.random.choice(range(self.data.shape[0]), p=probabilities)
+            new_centroid_index = rng.choice(n, p=probabilities)
             # Append the new centroid index to the list of centroid indices
             centroid_indices.append(new_centroid_index)
+            # Only the distances to the newest centroid have to be computed
+            new_distances = self._nearest_centroid(self.data[new_centroid_index][np.newaxis, :])[1]
+            np.minimum(min_distances, new_distances, out=min_distances)
         # Create a list of the selected centroids
         initial_centroids = [self.data[i] for i in centroid_indices]
         return initial_centroids
+
+
+    def _pick_centroids_kmeans_parallel(self, rng=np.random, oversampling=None, rounds=5):
+        """Selects the initial centroids using the K-means|| algorithm (scalable K-means++).
+        In each round every point is sampled independently with probability proportional to its squared distance,
+        which gives a set of candidates that is reduced to the desired amount of centroids by weighted K-means++"""
+        n = self.data.shape[0]
+        if oversampling is None:
+            oversampling = 2 * self.clusters
+        candidate_indices = [rng.choice(n)]
+        min_distances = self._nearest_centroid(self.data[candidate_indices[0]][np.newaxis, :])[1]
+        for _ in range(rounds):
+            cost = np.sum(min_distances)
+            if cost == 0:
+                break
+            # Sample every point independently with probability oversampling * d^2 / cost
+            probabilities = np.minimum(1.0, oversampling * min_distances / cost)
+            new_indices = np.flatnonzero(rng.random(n) < probabilities)
+            if len(new_indices) == 0:
+                continue
+            candidate_indices.extend(new_indices.tolist())
+            new_distances = self._nearest_centroid(self.data[new_indices])[1]
+            np.minimum(min_distances, new_distances, out=min_distances)
+        candidate_indices = np.unique(candidate_indices)
+        # Make sure that there are at least as many candidates as clusters
+        if len(candidate_indices) < self.clusters:
+            remaining = np.setdiff1d(np.arange(n), candidate_indices)
+            extra = rng.choice(remaining, size = self.clusters - len(candidate_indices), replace = False)
+            candidate_indices = np.sort(np.concatenate([candidate_indices, extra]))
+        candidates = self.data[candidate_indices]
+        # Weight each candidate by the number of data points closest to it
+        labels = self._nearest_centroid(candidates)[0]
+        weights = np.bincount(labels, minlength=len(candidate_indices)).astype(np.float64)
+        # Weighted K-means++ on the candidates
+        chosen = [rng.choice(len(candidate_indices), p=weights / np.sum(weights))]
+        min_distances = np.sum((candidates - candidates[chosen[0]]) ** 2, axis=1)
+        while len(chosen) < self.clusters:
+            scores = weights * min_distances
+            scores[chosen] = 0
+            if np.sum(scores) > 0:
+                probabilities = scores / np.sum(scores)
+            else:
+                # Fall back to a uniform pick among the candidates that are not chosen yet
+                probabilities = np.ones(len(candidate_indices))
+                probabilities[chosen] = 0
+                probabilities /= np.sum(probabilities)
+            new_candidate = rng.choice(len(candidate_indices), p=probabilities)
+            chosen.append(new_candidate)
+            np.minimum(min_distances, np.sum((candidates - candidates[new_candidate]) ** 2, axis=1), out=min_distances)
+        initial_centroids = [self.data[candidate_indices[i]] for i in chosen]
+        return initial_centroids
+
+
+    def _pick_centroids(self):
+        '''Selects the initial centroids with the initialisation method chosen in self.init'''
+        if isinstance(self.init, np.ndarray):
+            # Initial centroids given directly, e.g. to warm start from an earlier clustering
+            if self.init.shape != (self.clusters, self.data.shape[1]):
+                raise ValueError(f"Initial centroids must have shape {(self.clusters, self.data.shape[1])}")
+            return np.array(self.init, dtype=np.float64)
+        rng = _check_random_state(self.seed)
+        if self.init == "k-means++":
+            return np.array(self._pick_centroids_kmeans_plusplus(rng), dtype=np.float64)
+        if self.init == "k-means||":
+            return np.array(self._pick_centroids_kmeans_parallel(rng), dtype=np.float64)
+        if self.init == "random":
+            return np.array(self._pick_centroids_random(rng), dtype=np.float64)
+        raise ValueError("Unknown initialisation method: " + str(self.init))
     
 
-    def _initialise_cluster_dict(self):
-        '''Initialises the cluster dict according to the designated amount of clusters assigned'''
-        self.cluster_dict.clear()
-        for i in range(self.clusters):
-            self.cluster_dict["Cluster-" + str(i+1)] = list()
-        return self.cluster_dict
+    def _chunks(self):
+        '''Yields the data in blocks of chunk_size rows together with the index of the first row'''
+        for start in range(0, self.data.shape[0], self.chunk_size):
+            yield start, self.data[start:start + self.chunk_size]
+
+
+    def _map_blocks(self, function):
+        '''Calls function(start, block) for every block of chunk_size rows and returns the results in the order of the blocks.
+        With n_threads > 1 (None or -1 for all cpus) the blocks are processed in a pool of threads, as numpy releases the GIL
+        in the matrix products and ufuncs. The blocks do not depend on the number of threads and the results are combined
+        in the order of the blocks, so the clustering gives the same result with any number of threads.
+        During a fit the pool of the fit is used, otherwise a pool is made for this call only'''
+        starts = range(0, self.data.shape[0], self.chunk_size)
+        def run(start):
+            return function(start, self.data[start:start + self.chunk_size])
+        n_threads = self._thread_count()
+        if n_threads == 1 or len(starts) <= 1:
+            return [run(start) for start in starts]
+        if self._pool is not None:
+            return list(self._pool.map(run, starts))
+        with concurrent.futures.ThreadPoolExecutor(max_workers = min(n_threads, len(starts))) as pool:
+            return list(pool.map(run, starts))
+
+
+    def _thread_count(self):
+        '''Number of threads used for the blocks, None or a number below 1 means all cpus'''
+        return os.cpu_count() if self.n_threads is None or self.n_threads < 1 else self.n_threads
+
+
+    def _squared_norms(self):
+        '''Squared norm of every data point, computed once per fit and used by every distance computation of the fit'''
+        norms = np.empty(self.data.shape[0], dtype=np.float64)
+        def squared_norms(start, block):
+            norms[start:start + block.shape[0]] = np.einsum("ij,ij->i", block, block, dtype=np.float64)
+        self._map_blocks(squared_norms)
+        return norms
+
+
+    def _block_norms(self, start, block):
+        '''The squared norms of the points in the block starting at row start, None if they are not computed'''
+        return None if self._norms is None else self._norms[start:start + block.shape[0]]
+
+
+    def _squared_distances(self, block, centroids, block_norms = None):
+        '''Squared euclidian distances from every point in the block to every centroid (block rows x centroids).
+        They are computed as ||x||^2 - 2 x.c + ||c||^2, so most of the work is one matrix product.
+        block_norms are the squared norms of the points in the block, they are computed (in float64) if not given.
+        For a float32 block the distances are computed in float32, with the centroids cast down for the matrix product,
+        which halves the memory traffic. The norms are computed in float64 before they are cast down'''
+        if block_norms is None:
+            block_norms = np.einsum("ij,ij->i", block, block, dtype=np.float64)
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        if block.dtype == np.float32:
+            distances = block @ centroids.astype(np.float32).T
+            block_norms = block_norms.astype(np.float32)
+            centroid_norms = centroid_norms.astype(np.float32)
+        else:
+            distances = block @ centroids.T
+        distances *= -2
+        distances += block_norms[:, np.newaxis]
+        distances += centroid_norms
+        # Rounding errors can make the distance from a point to itself slightly negative
+        return np.maximum(distances, 0, out = distances)
+
+
+    def _nearest_centroid(self, centroids):
+        '''Finds the index of and the squared distance to the nearest centroid for every data point'''
+        n = self.data.shape[0]
+        labels = np.empty(n, dtype=np.int32)
+        min_distances = np.empty(n, dtype=np.float64)
+        def nearest(start, block):
+            rows = slice(start, start + block.shape[0])
+            distances = self._squared_distances(block, centroids, self._block_norms(start, block))
+            labels[rows] = np.argmin(distances, axis=1)
+            min_distances[rows] = distances[np.arange(block.shape[0]), labels[rows]]
+        self._map_blocks(nearest)
+        return labels, min_distances
+
+
+    def _block_sums(self, block, block_labels):
+        '''Sums up the points of each cluster in a block and counts them'''
+        counts = np.bincount(block_labels, minlength=self.clusters)
+        sums = np.empty(shape=(self.clusters, block.shape[1]), dtype=np.float64)
+        # Per cluster sums of the coordinates, one dimension at a time
+        for dim in range(block.shape[1]):
+            sums[:, dim] = np.bincount(block_labels, weights=block[:, dim], minlength=self.clusters)
+        return sums, counts
+
+
+    def _assign_and_accumulate(self, centroids):
+        '''Assigns every data point to its nearest centroid and sums up the points of each cluster.
+        The distance matrix is computed for one block of rows at a time, so memory use is bounded by chunk_size'''
+        labels = np.empty(self.data.shape[0], dtype=np.int32)
+        def assign(start, block):
+            block_labels = labels[start:start + block.shape[0]]
+            block_labels[:] = np.argmin(self._squared_distances(block, centroids, self._block_norms(start, block)), axis=1)
+            return self._block_sums(block, block_labels)
+        sums = np.zeros(shape=(self.clusters, self.data.shape[1]), dtype=np.float64)
+        counts = np.zeros(self.clusters, dtype=np.int64)
+        # The sums of the blocks are added in the order of the blocks, whichever thread computed them
+        for block_sums, block_counts in self._map_blocks(assign):
+            sums += block_sums
+            counts += block_counts
+        return labels, sums, counts
+
+
+    @property
+    def cluster_dict(self):
+        '''The cluster assignments as a dict of "Cluster-<number>": list of indices. It is a view of self.result,
+        so the lists are only made when they are looked up'''
+        if self.result is None:
+            return dict()
+        return self.result.cluster_dict
+
+
+    def _check_clusters(self, clusters = None):
+        '''Error handling to make sure that the number of clusters (of the instance if not given) is provided as an integer above 0'''
+        if clusters is None:
+            clusters = self.clusters
+        if clusters is None:
+            raise ValueError("Number of clusters must be provided")
+        if not isinstance(clusters, int):
+            raise ValueError("Number of clusters must be an integer")
+        if clusters < 1:
+            raise ValueError("Number of clusters must be greater than 0")
+
+
+    def _check_data_clusters(self, clusters = None):
+        '''Error handling to make sure that data is loaded and the number of clusters (of the instance if not given)
+        is provided as an integer above 0 and does not exceed number of observations'''
+        if self.data.size == 0:
+            raise ValueError("No data loaded")
+        if clusters is None:
+            clusters = self.clusters
+        self._check_clusters(clusters)
+        if clusters > self.data.shape[0]:
+            raise ValueError(f"Number of clusters must not exceed number of obervations which is: {self.data.shape[0]}")
 
 
     def cluster(self):
         '''The function that clusters the data points and updates the centroids until convergence is reached'''
-        # Error handling to make sure that data is loaded, number of clusters is provided as an integer above 0 and does not exceed number of observations:
+        self._check_data_clusters()
+        with self._timer("cluster"):
+            if self.n_init > 1:
+                labels, centroids = self._cluster_restarts()
+            else:
+                labels, centroids, self.inertia = self._fit()
+                self.restarts = [{"inertia": self.inertia, "n_iter": self.n_iter}]
+        if self.instrument:
+            self._count("clusterings", 1)
+            self._count("iterations", self.n_iter)
+            if self.distance_evaluations is not None:
+                self._count("distance_evaluations", self.distance_evaluations)
+                self._count("skipped_distances", self.skipped_distances)
+                self._count("bound_evaluations", self.bound_evaluations)
+            self.stats["inertia_history"] = self.inertia_history
+            self.stats["iteration_times"] = self.iteration_times
+        self.result = kmeans_result(labels, centroids, self.inertia)
+        self._sums = None
+        self.labels = self.result.labels
+        self.centroids = list(self.result.centroids)
+        return self.cluster_dict, self.centroids
+
+
+    def _fit(self):
+        '''Runs the chosen clustering algorithm once and returns the labels, centroids and inertia.
+        One pool of threads is made for the whole fit and used by every block operation of it'''
+        if self.algorithm not in ("lloyd", "hamerly", "elkan", "minibatch"):
+            raise ValueError("Unknown algorithm: " + str(self.algorithm))
+        if self.convergence not in ("shift", "inertia"):
+            raise ValueError("Unknown convergence criterion: " + str(self.convergence))
+        if not isinstance(self.max_iter, (int, np.integer)) or self.max_iter < 1:
+            raise ValueError("Maximum number of iterations must be an integer greater than 0")
+        if not isinstance(self.tol, (int, float, np.integer, np.floating)) or not self.tol >= 0:
+            raise ValueError("Tolerance must be a number that is not negative")
+        n_threads = min(self._thread_count(), -(-self.data.shape[0] // self.chunk_size))
+        if n_threads > 1:
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers = n_threads)
+        try:
+            self._norms = self._squared_norms()
+            if self.algorithm == "minibatch":
+                centroids = self._cluster_minibatch()
+                labels = self._nearest_centroid(centroids)[0]
+            else:
+                labels, centroids = self._cluster_lloyd()
+            inertia = self._inertia(labels, centroids)
+        finally:
+            # The norms belong to the data of this fit only, the data can be changed afterwards
+            self._norms = None
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        return labels, centroids, inertia
+
+
+    def _inertia(self, labels, centroids):
+        '''Sum of squared distances from every data point to the centroid of its cluster'''
+        def block_inertia(start, block):
+            return np.sum((block - centroids[labels[start:start + block.shape[0]]]) ** 2)
+        inertia = 0.0
+        for value in self._map_blocks(block_inertia):
+            inertia += value
+        return float(inertia)
+
+
+    def _cluster_restarts(self):
+        '''Clusters the data n_init times from different seeds and keeps the run with the lowest inertia.
+        With n_jobs > 1 the runs are done in a pool of processes, which all read the same memory-mapped copy of the data'''
+        results = self.cluster_many([{}] * self.n_init, _spawn_seeds(self.seed, self.n_init), self.n_jobs)
+        self.restarts = [{"inertia": result["inertia"], "n_iter": result["n_iter"]} for result in results]
+        best = min(results, key = lambda result: result["inertia"])
+        for name in ("inertia", "n_iter", "distance_evaluations", "skipped_distances", "bound_evaluations", "iteration_times", "inertia_history"):
+            setattr(self, name, best[name])
+        return best["labels"], best["centroids"]
+
+
+    def cluster_many(self, settings_list, seeds = None, n_jobs = 1):
+        '''Runs independent clusterings of the loaded data, one for each dict of settings (e.g. {"clusters": 3}) and seed.
+        Without seeds, independent seeds are spawned from self.seed. With n_jobs > 1 (None or -1 for all cpus) the runs are done in a pool of processes, which all read the same
+        memory-mapped copy of the data. Returns a list with a dict of labels, centroids, inertia and n_iter for each run'''
         if self.data.size == 0:
             raise ValueError("No data loaded")
-        if self.clusters is None:
-            raise ValueError("Number of clusters must be provided")
-        if not isinstance(self.clusters, int):
-            raise ValueError("Number of clusters must be an integer")
-        if self.clusters > len(self.vector_list):
-            raise ValueError(f"Number of clusters must not exceed number of obervations which is: {len(self.vector_list)}")
-        if self.clusters == 0:
-            raise ValueError("Number of clusters must be greater than 0")
-        # Initialisation of variables
-        convergence = False
-        max_iterations = 200
-        iteration = 0
-        centroids = self._pick_centroids_kmeans_plusplus() 
-        #centroids = self._pick_centroids_random() # Uncomment this line to use random initialisation of centroids
-        while not convergence and iteration <= max_iterations:
-            new_centroids = list()
-            self.cluster_dict = self._initialise_cluster_dict()
-            #####---Assign data points to clusters---#####
-            # Loop through the observations
-            for i in range(self.data.shape[0]):
-                distances = list()
-                # Loop through centroids and calculate the distance to each centroid
-                for j in range(self.clusters):
-                    distance = self._euclidian(self.data[i], centroids[j])
-                    distances.append(distance)
-                # Find the index of the centroid with the lowest distance to the observation
-                min_distance = min(distances)
-                min_index = distances.index(min_distance)
-                # Assign the observation to the cluster with the lowest distance
-                cluster_key = "Cluster-" + str(min_index+1)
-                self.cluster_dict[cluster_key].append(i)
+        settings_list = [dict(self._settings(), **settings) for settings in settings_list]
+        for settings in settings_list:
+            self._check_data_clusters(settings["clusters"])
+        if seeds is None:
+            seeds = _spawn_seeds(self.seed, len(settings_list))
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count()
+        if n_jobs == 1 or len(settings_list) == 1:
+            return [_fit_restart(self.data, settings, seed) for settings, seed in zip(settings_list, seeds)]
+        with _shared_data(self.data) as (data_path, on_disk):
+            with concurrent.futures.ProcessPoolExecutor(max_workers = min(n_jobs, len(settings_list))) as pool:
+                tasks = [(data_path, on_disk, settings, seed) for settings, seed in zip(settings_list, seeds)]
+                return list(pool.map(_fit_restart_worker, tasks))
+
+
+    def _settings(self):
+        '''The settings of the instance that a single clustering run depends on'''
+        return {name: getattr(self, name) for name in ("clusters", "init", "algorithm", "chunk_size", "n_threads", "batch_size", "max_iter", "tol", "convergence", "dtype")}
+
+
+    def cluster_stream(self, blocks):
+        '''Clusters a stream of data with the mini-batch algorithm. blocks is an iterable of 2D arrays of rows,
+        e.g. read_blocks(filename), so the data never has to be loaded as a whole. Only the centroids are kept'''
+        self._check_clusters()
+        centroids = self._cluster_minibatch(blocks)
+        self.result = None
+        self._sums = None
+        self.labels = None
+        self.centroids = list(centroids)
+        return self.centroids
+
+
+    def _cluster_lloyd(self):
+        '''Full batch k-means (Lloyd's algorithm): assigns all points and moves every centroid to the mean of its points.
+        With algorithm "hamerly" or "elkan" the assignment step uses distance bounds to skip distance computations,
+        which gives the same result as plain Lloyd. Stops after max_iter iterations, when no point changes cluster
+        or when the convergence criterion is met (see __init__). Empty clusters are moved to the points farthest
+        from their centroids. Unless it stopped because no point changed cluster, the points are assigned to the
+        final centroids once more, so the labels always belong to the returned centroids'''
+        with self._timer("seed"):
+            centroids = self._pick_centroids()
+        if self.algorithm == "hamerly":
+            bounds = _HamerlyBounds(self)
+        elif self.algorithm == "elkan":
+            bounds = _ElkanBounds(self)
+        else:
+            bounds = None
+        assign = self._assign_and_accumulate if bounds is None else bounds.assign
+        n = self.data.shape[0]
+        # The inertia and the variance are computed from the points shifted by the first point, otherwise
+        # the sums of the expanded squares cancel for data far from the origin
+        origin = np.array(self.data[0], dtype=np.float64)
+        def shifted_norms(start, block):
+            shifted = block - origin
+            return np.einsum("ij,ij->", shifted, shifted)
+        total_norm = 0.0
+        for value in self._map_blocks(shifted_norms):
+            total_norm += value
+        previous_labels = None
+        unchanged = False
+        self.iteration_times = list()
+        self.inertia_history = list()
+        for iteration in range(1, self.max_iter + 1):
+            start_time = time.perf_counter()
+            #####---Assign data points to clusters and accumulate the new centroids---#####
+            labels, sums, counts = assign(centroids)
+            # Sum of the squared distances to the assigned centroids, from the norms of the points and the sums of the clusters
+            shifted_centroids = centroids - origin
+            shifted_sums = sums - counts[:, np.newaxis] * origin
+            inertia = max(total_norm - 2 * np.sum(shifted_centroids * shifted_sums) + np.sum(counts * np.sum(shifted_centroids ** 2, axis=1)), 0.0)
+            if iteration == 1:
+                # Mean variance of the dimensions of the data, the scale of the tolerance on the shift
+                mean_variance = (total_norm / n - np.sum((np.sum(shifted_sums, axis=0) / n) ** 2)) / self.data.shape[1]
             #####---Update centroids---#####
-            for key in self.cluster_dict.keys():
-                # Get the indices of the observations in the cluster
-                index_ls = self.cluster_dict[key]
-                # Create an empty array of correct shape to store the data points in the cluster
-                rows = len(index_ls)
-                cols = self.data.shape[1]
-                centroid_data = np.empty(shape=(rows, cols), dtype=np.float64)
-                # Loop through the indices and store the data points in the cluster
-                for i, index in enumerate(index_ls):
-                    centroid_data[i] = self.data[index]
-                centroid = np.mean(centroid_data, axis = 0)
-                # Round the centroid to a certain number of decimals
-                centroid = np.round(centroid, decimals=3)
-                new_centroids.append(centroid)
+            new_centroids = centroids.copy()
+            filled = counts > 0
+            new_centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+            if not np.all(filled):
+                new_centroids[~filled] = self._farthest_points(centroids, np.count_nonzero(~filled))
             #####---Check for convergence---#####
-            if np.array_equal(centroids, new_centroids):
-               convergence = True
-            # Update the centroids and increase the iteration counter
-            iteration += 1
+            shift = np.sum((new_centroids - centroids) ** 2)
+            if self.callback is not None:
+                self.callback(iteration, float(inertia), float(shift))
+            if self.convergence == "shift":
+                converged = shift <= self.tol * mean_variance
+            else:
+                converged = len(self.inertia_history) > 0 and abs(self.inertia_history[-1] - inertia) <= self.tol * self.inertia_history[-1]
+            # Without empty clusters and changed labels the centroids cannot move any more
+            unchanged = np.all(filled) and previous_labels is not None and np.array_equal(labels, previous_labels)
+            converged = converged or unchanged
             centroids = new_centroids
-        self.centroids = centroids
-        return self.cluster_dict, self.centroids
+            previous_labels = labels
+            self.inertia_history.append(float(inertia))
+            self.iteration_times.append(time.perf_counter() - start_time)
+            if converged:
+                break
+        self.n_iter = iteration
+        # Count the point-centroid distances that were computed and skipped in the assignment steps
+        total = iteration * self.data.shape[0] * self.clusters
+        self.distance_evaluations = total if bounds is None else bounds.evaluations
+        if not unchanged:
+            # The labels belong to the centroids before the last update, assign the points to the final centroids
+            labels = self._nearest_centroid(centroids)[0]
+            total += self.data.shape[0] * self.clusters
+            self.distance_evaluations += self.data.shape[0] * self.clusters
+        self.skipped_distances = total - self.distance_evaluations
+        self.bound_evaluations = 0 if bounds is None else bounds.tightenings
+        return labels, centroids
+
+
+    def _farthest_points(self, centroids, number):
+        '''The number points that are farthest from their nearest centroid, used as new centroids for empty clusters'''
+        distances = self._nearest_centroid(centroids)[1]
+        farthest = np.argsort(-distances, kind="stable")[:number]
+        return self.data[farthest]
+
+
+    def _minibatches(self, rng):
+        '''Yields mini-batches of the loaded data. Data in memory is sampled randomly,
+        data on disk is read as consecutive blocks to avoid random reads'''
+        n = self.data.shape[0]
+        if isinstance(self.data, _DiskArray):
+            for start in itertools.cycle(range(0, n, self.batch_size)):
+                yield self.data[start:start + self.batch_size]
+        else:
+            while True:
+                yield self.data[rng.choice(n, size = min(self.batch_size, n))]
+
+
+    def _minibatch_step(self, batch, centroids, counts):
+        '''Moves the centroids towards the points of one mini-batch with a learning rate per centroid (Sculley, 2010).
+        The learning rate of a centroid is 1 / the number of points it has been assigned so far,
+        so each centroid is the running mean of its points. counts is updated in place'''
+        batch_labels = np.argmin(self._squared_distances(batch, centroids), axis=1)
+        batch_sums, batch_counts = self._block_sums(batch, batch_labels)
+        counts += batch_counts
+        updated = batch_counts > 0
+        new_centroids = centroids.copy()
+        new_centroids[updated] += (batch_sums[updated] - batch_counts[updated, np.newaxis] * centroids[updated]) / counts[updated, np.newaxis]
+        return new_centroids
+
+
+    def _pick_centroids_from(self, points):
+        '''Picks the initial centroids from the given points instead of the loaded data'''
+        seeding_kmeans = kmeans(clusters = self.clusters, seed = self.seed, init = self.init)
+        seeding_kmeans.data = points
+        return seeding_kmeans._pick_centroids()
+
+
+    def _cluster_minibatch(self, blocks=None):
+        '''Mini-batch k-means on the loaded data or, if blocks is given, on a stream of blocks of rows.
+        Stops after max_iter batches or when the smoothed centroid shift per batch falls below
+        tol times the mean variance of the first batch. The time of every batch is kept in iteration_times,
+        the inertia of the data is not computed, so inertia_history stays empty'''
+        rng = _check_random_state(self.seed)
+        self.iteration_times = list()
+        self.inertia_history = list()
+        if blocks is None:
+            with self._timer("seed"):
+                centroids = self._pick_centroids()
+            batches = self._minibatches(rng)
+        else:
+            batches = _rebatch(blocks, max(self.batch_size, self.clusters), self._data_dtype())
+            first_batch = next(batches, None)
+            if first_batch is None or first_batch.shape[0] < self.clusters:
+                raise ValueError("The stream must contain at least as many observations as clusters")
+            # The initial centroids are picked from the first batch
+            centroids = self._pick_centroids_from(first_batch)
+            batches = itertools.chain([first_batch], batches)
+        counts = np.zeros(self.clusters, dtype=np.int64)
+        threshold = None
+        smoothed_shift = None
+        iteration = 0
+        start_time = time.perf_counter()
+        for batch in batches:
+            if threshold is None:
+                threshold = self.tol * np.mean(np.var(batch, axis=0))
+            new_centroids = self._minibatch_step(batch, centroids, counts)
+            shift = np.sum((new_centroids - centroids) ** 2)
+            centroids = new_centroids
+            iteration += 1
+            # The time of a batch includes drawing or reading it
+            self.iteration_times.append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            if self.callback is not None:
+                self.callback(iteration, None, float(shift))
+            # Exponentially weighted average of the shift, as single batches are noisy
+            smoothed_shift = shift if smoothed_shift is None else 0.9 * smoothed_shift + 0.1 * shift
+            if iteration >= self.max_iter or (iteration > 1 and smoothed_shift <= threshold):
+                break
+        self.n_iter = iteration
+        self.distance_evaluations = None
+        self.skipped_distances = None
+        self.bound_evaluations = None
+        return centroids
     
 
-    def write(self, outfile):
-        '''Writes the cluster assignments and centroids to standard output or writes a new file if outfile is not None'''
-        try:
-            if outfile is None:
-                outfile = sys.stdout
-            else:
-                outfile = open(outfile, "w")
-        except IOError as err:
-            print(err)
-            sys.exit(1)
+    def _fitted_centroids(self):
+        '''The centroids of the fitted model as an array, error handling to make sure that there is one'''
+        if self.centroids is None:
+            raise ValueError("No clusters have been assigned. Please run the cluster method or load a model first.")
+        return np.asarray(self.centroids, dtype=np.float64)
+
+
+    def _input_blocks(self, points, dims):
+        '''Yields the points to score in blocks of at most chunk_size rows. points is an array or the name of a .lst file,
+        which is read one block at a time'''
+        if isinstance(points, str):
+            blocks = read_blocks(points, self.chunk_size, self._data_dtype())
+        else:
+            points = np.atleast_2d(np.asarray(points, dtype=self._data_dtype()))
+            blocks = (points[start:start + self.chunk_size] for start in range(0, points.shape[0], self.chunk_size))
+        for block in blocks:
+            if block.shape[1] != dims:
+                raise ValueError(f"The points have {block.shape[1]} dimensions, but the model has {dims}")
+            yield block
+
+
+    def predict(self, points):
+        '''Returns the index of the nearest centroid for every point in points (an array or the name of a .lst file).
+        The points are scored in blocks of chunk_size rows, so only the distances of one block are kept at a time'''
+        centroids = self._fitted_centroids()
+        labels = [np.argmin(self._squared_distances(block, centroids), axis=1).astype(np.int32)
+                  for block in self._input_blocks(points, centroids.shape[1])]
+        return np.concatenate(labels) if labels else np.empty(0, dtype=np.int32)
+
+
+    def transform(self, points):
+        '''Returns the euclidian distance from every point in points (an array or the name of a .lst file) to every centroid
+        as an array of points x centroids. The points are processed in blocks of chunk_size rows'''
+        centroids = self._fitted_centroids()
+        distances = [np.sqrt(self._squared_distances(block, centroids)) for block in self._input_blocks(points, centroids.shape[1])]
+        return np.concatenate(distances) if distances else np.empty((0, centroids.shape[0]))
+
+
+    def partial_fit(self, batch):
+        '''Updates the centroids with a new batch of points (an array of rows) and returns the labels of the new points.
+        The sum and number of the points of every cluster are kept, so each centroid is the mean of its points and a batch
+        costs O(batch x clusters) distances. The first batch continues from the last fit or loaded model, or else the initial
+        centroids are picked from it. With decay < 1 the earlier points count decay times less for every new batch.
+        The distance of every centroid from where it started (the drift) is kept in self.drift and written to stderr
+        every drift_interval batches, to show when the data has changed enough to cluster it again'''
+        batch = np.atleast_2d(np.asarray(batch, dtype=self._data_dtype()))
+        if self._sums is None:
+            self._start_partial_fit(batch)
+        centroids = self._fitted_centroids()
+        if batch.shape[1] != centroids.shape[1]:
+            raise ValueError(f"The points have {batch.shape[1]} dimensions, but the model has {centroids.shape[1]}")
+        labels = np.argmin(self._squared_distances(batch, centroids), axis=1).astype(np.int32)
+        batch_sums, batch_counts = self._block_sums(batch, labels)
+        self._sums = self.decay * self._sums + batch_sums
+        self._counts = self.decay * self._counts + batch_counts
+        updated = self._counts > 0
+        centroids[updated] = self._sums[updated] / self._counts[updated, np.newaxis]
+        if self._reference is None:
+            self._reference = centroids.copy()
+        self.drift = np.sqrt(np.sum((centroids - self._reference) ** 2, axis=1))
+        self.n_batches += 1
+        if self.drift_interval and self.n_batches % self.drift_interval == 0:
+            sys.stderr.write(f"Batch {self.n_batches}: largest centroid drift {np.max(self.drift):g}\n")
+        # The labels of the loaded data no longer belong to the centroids
+        self.result = None
+        self.labels = None
+        self.centroids = list(centroids)
+        return labels
+
+
+    def _start_partial_fit(self, batch):
+        '''Sets up the sums and numbers of points kept by partial_fit. A fitted clustering counts as its points,
+        centroids of a loaded model or a stream are kept until points are assigned to them'''
+        self.n_batches = 0
+        if self.centroids is None:
+            self._check_clusters()
+            if batch.shape[0] < self.clusters:
+                raise ValueError("The first batch must contain at least as many observations as clusters")
+            self.centroids = list(self._pick_centroids_from(batch))
+            # The drift is measured from the centroids after the first batch
+            self._reference = None
+        else:
+            self._reference = self._fitted_centroids()
+        centroids = self._fitted_centroids()
+        self.clusters = centroids.shape[0]
+        if self.result is not None:
+            self._counts = self.result.counts.astype(np.float64)
+        else:
+            self._counts = np.zeros(self.clusters)
+        self._sums = centroids * self._counts[:, np.newaxis]
+
+
+    def write(self, outfile, format=None):
+        '''Writes the cluster assignments and centroids to standard output or writes a new file if outfile is not None.
+        format is "text" (the cluster layout with every data point), "labels" (only the cluster number of every point),
+        "npz" or "columns" (binary files with the labels, centroids and ids). If format is None it is chosen from the
+        extension of outfile (.npz, .cols), otherwise text is written'''
+        if format is None:
+            format = _WRITE_FORMATS.get(os.path.splitext(outfile)[1], "text") if outfile is not None else "text"
+        if format not in ("text", "labels", "npz", "columns"):
+            raise ValueError("Unknown output format: " + str(format))
         # Error handling to make sure that clusters have been created before writing to file
-        if len(self.cluster_dict) == 0:
+        if self.result is None:
             raise ValueError("No clusters have been assigned. Please run the cluster method before writing to file.")
-        # Write the cluster assignments and centroids to the output
-        for i, key in enumerate(self.cluster_dict.keys()):   
-            centroids_values = "\t".join([str(value) for value in self.centroids[i]])
-            outfile.write(key + "\t" + centroids_values + "\n")
-            for index in self.cluster_dict[key]:
-                if len(self.ids) == 0:
-                    data_point = "\t".join([str(value) for value in self.data[index]])
-                    outfile.write(data_point + "\n")
-                else:
-                    data_point = self.ids[index] + "\t" + "\t".join([str(value) for value in self.data[index]])
-                    outfile.write(data_point + "\n")
+        if format in ("npz", "columns"):
+            if outfile is None:
+                raise ValueError("An outfile is needed to write the " + format + " format")
+            with self._timer("write"):
+                self._write_binary(outfile, format)
+            if self.instrument:
+                self._count("bytes_written", os.path.getsize(outfile))
+            print("Data was written to " + outfile)
+            return
+        # An outfile that cannot be opened raises an OSError, which the command line reports
+        if outfile is None:
+            outfile = sys.stdout
+        else:
+            outfile = open(outfile, "w")
+        with self._timer("write"):
+            if format == "labels":
+                written = self._write_labels(outfile)
+            else:
+                written = self._write_text(outfile)
+        if self.instrument:
+            # The text is ASCII, so the number of characters is the number of bytes
+            self._count("bytes_written", written)
         if outfile is sys.stdout:
             print("Data was written to standard output. If you want to write to a file, please provide an outfilename as an argument. Example: ./cluster.py " + filename + " " + clusters + " <name of outfile>")
         else:
             print("Data was written to " + outfile.name)
         outfile.close()
 
-            
-     
+    def _write_text(self, outfile):
+        '''Writes every cluster as a line with its centroid followed by a line for each of its data points.
+        Each block of rows is formatted at once and written with a single call. Returns the number of characters written'''
+        ids = self.ids if isinstance(self.ids, _DiskArray) or len(self.ids) == 0 else np.asarray(self.ids)
+        if isinstance(self.data, _DiskArray):
+            return self._write_text_spilled(outfile, ids)
+        written = 0
+        for i in range(len(self.result.centroids)):
+            written += outfile.write(_format_rows(self.result.centroids[i][np.newaxis], np.array(["Cluster-" + str(i+1)])))
+            for rows, row_ids in self._cluster_blocks(i, ids):
+                written += outfile.write(_format_rows(rows, row_ids))
+        return written
 
-if __name__ == "__main__":
-    # outfilename should be None if it is not given as an argument on the command line
-    outfilename = None
-
-    # Get command line arguments
-    if len(sys.argv) == 1:
-        filename = input("Please enter a data file: ")
-        clusters = input("Please enter number of clusters: ")
-    elif len(sys.argv) == 2:
-        filename = sys.argv[1]
-        clusters = input("Please enter number of clusters: ")
-    elif len(sys.argv) == 3:
-        filename = sys.argv[1]
-        clusters = sys.argv[2]
-    elif len(sys.argv) == 4:
-        filename = sys.argv[1]
-        clusters = sys.argv[2]
-        outfilename = sys.argv[3]
+    def _write_text_spilled(self, outfile, ids):
+        '''Writes the text layout of data on disk (mmap=True) with one pass over the data: the formatted rows of every cluster
+        are appended to a temporary file per cluster, next to the outfile, which are copied to the outfile in the order of
+        the clusters afterwards. Returns the number of characters written'''
+        clusters = len(self.result.centroids)
+        spill_dir = None if outfile is sys.stdout else os.path.dirname(os.path.abspath(outfile.name))
+        with tempfile.TemporaryDirectory(dir = spill_dir) as spill_dir:
+            paths = [os.path.join(spill_dir, str(i)) for i in range(clusters)]
+            pending = [list() for _ in range(clusters)]
+            pending_characters = 0
+            def spill():
+                for i in range(clusters):
+                    if pending[i]:
+                        with open(paths[i], "a") as spill_file:
+                            spill_file.write("".join(pending[i]))
+                        pending[i].clear()
+            for start, block in self._chunks():
+                # The rows of the block sorted by cluster, cluster i has the rows order[bounds[i]:bounds[i+1]]
+                block_labels = self.result.labels[start:start + block.shape[0]]
+                order = np.argsort(block_labels, kind="stable")
+                bounds = np.searchsorted(block_labels[order], np.arange(clusters + 1))
+                block_ids = None if len(ids) == 0 else ids[start:start + block.shape[0]]
+                for i in np.flatnonzero(np.diff(bounds)):
+                    rows = order[bounds[i]:bounds[i + 1]]
+                    text = _format_rows(block[rows], None if block_ids is None else block_ids[rows])
+                    pending[i].append(text)
+                    pending_characters += len(text)
+                if pending_characters > _SPILL_CHARACTERS:
+                    spill()
+                    pending_characters = 0
+            spill()
+            written = 0
+            for i in range(clusters):
+                written += outfile.write(_format_rows(self.result.centroids[i][np.newaxis], np.array(["Cluster-" + str(i+1)])))
+                if os.path.exists(paths[i]):
+                    with open(paths[i]) as spill_file:
+                        for text in iter(lambda: spill_file.read(1 << 20), ""):
+                            written += outfile.write(text)
+        return written
+
+    def _cluster_blocks(self, i, ids):
+        '''Yields the data points of cluster i and their ids (None if ids is empty) in blocks of at most chunk_size rows'''
+        indices = self.result.indices(i)
+        for start in range(0, len(indices), self.chunk_size):
+            block_indices = indices[start:start + self.chunk_size]
+            yield self.data[block_indices], None if len(ids) == 0 else ids[block_indices]
+
+    def _write_labels(self, outfile):
+        '''Writes the cluster index (from 0, as in result.labels, predict and the binary formats) of every data point
+        in the order of the data, after the id of the point if the data has ids. Returns the number of characters written'''
+        written = 0
+        for start in range(0, len(self.result.labels), self.chunk_size):
+            numbers = self.result.labels[start:start + self.chunk_size].astype(str)
+            if len(self.ids) > 0:
+                numbers = np.char.add(np.char.add(np.asarray(self.ids[start:start + self.chunk_size], dtype=str), "\t"), numbers)
+            written += outfile.write("\n".join(numbers.tolist()) + "\n")
+        return written
+
+    def _write_binary(self, outfile, format):
+        '''Writes the labels, centroids and ids (if any) without the data points as a .npz file or a columns file'''
+        columns = {"labels": self.result.labels, "centroids": self.result.centroids}
+        if len(self.ids) > 0:
+            columns["ids"] = np.asarray(self.ids[:len(self.ids)], dtype=str)
+        if format == "npz":
+            with open(outfile, "wb") as output:
+                np.savez(output, **columns)
+        else:
+            write_columns(outfile, columns)
+
+
+    def save_model(self, filename):
+        '''Saves the fitted model (the centroids, their dimensionality and the settings) in a small .npz file,
+        so new points can be scored with predict after load_model without the data or refitting'''
+        centroids = self._fitted_centroids()
+        settings = self._settings()
+        settings["clusters"] = centroids.shape[0]
+        # An array given as init is the starting point of the fit and not part of the model
+        if not isinstance(settings["init"], str):
+            del settings["init"]
+        with open(filename, "wb") as outfile:
+            np.savez(outfile, centroids=centroids, dims=centroids.shape[1], settings=json.dumps(settings))
+
+
+    def load_model(self, filename):
+        '''Loads a model saved with save_model and returns its centroids. Clustering results of the instance are cleared.
+        A missing file raises FileNotFoundError and any other file than a saved model raises ValueError'''
+        try:
+            with np.load(filename, allow_pickle=False) as model:
+                centroids, dims, settings = model["centroids"], int(model["dims"]), json.loads(str(model["settings"]))
+        except FileNotFoundError:
+            raise
+        except (OSError, KeyError, ValueError):
+            raise ValueError(filename + " is not a saved kmeans model")
+        # Only the settings written by save_model are applied, so a model file cannot replace the data or other attributes
+        if centroids.ndim != 2 or centroids.shape[1] != dims or not isinstance(settings, dict) or not set(settings) <= set(self._settings()):
+            raise ValueError(filename + " is not a saved kmeans model")
+        for name, value in settings.items():
+            if not _MODEL_SETTINGS[name](value):
+                raise ValueError(filename + " is not a saved kmeans model, it has an invalid " + name + ": " + repr(value))
+        if settings.get("clusters", centroids.shape[0]) != centroids.shape[0]:
+            raise ValueError(filename + " is not a saved kmeans model, the number of clusters does not match the centroids")
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.result = None
+        self.labels = None
+        self.inertia = None
+        self._sums = None
+        self.centroids = list(centroids)
+        return self.centroids
+
+
+# Extension of the outfiles of each output format in batch mode
+_BATCH_EXTENSIONS = {"text": ".lst", "labels": ".lst", "npz": ".npz", "columns": ".cols"}
+
+
+def read_manifest(filename, clusters = ()):
+    '''Reads a batch manifest with a data file on each line followed by its numbers of clusters, separated by
+    whitespace or commas, e.g. "data/point1000.lst 3 5 8". Lines without numbers of clusters get clusters, and
+    empty lines and lines starting with # are skipped. Relative paths are relative to the manifest, and a file
+    that is listed twice is only loaded once. Returns a list of (data file, list of numbers of clusters)'''
+    directory = os.path.dirname(os.path.abspath(filename))
+    jobs = dict()
+    with open(filename) as infile:
+        for number, line in enumerate(infile, start = 1):
+            fields = re.split(r"[\s,]+", line.strip())
+            if fields[0] == "" or fields[0].startswith("#"):
+                continue
+            if not all(field.isdigit() for field in fields[1:]):
+                raise ValueError(f"Line {number} of {filename}: the numbers of clusters must be integers")
+            numbers = [int(field) for field in fields[1:]] or list(clusters)
+            if not numbers:
+                raise ValueError(f"Line {number} of {filename}: no number of clusters for {fields[0]}")
+            listed = jobs.setdefault(os.path.join(directory, fields[0]), list())
+            listed += [K for K in numbers if K not in listed]
+    return list(jobs.items())
+
+
+def run_batch(jobs, output_dir, settings = None, format = "text", n_jobs = None, seed = 0, instrument = False):
+    '''Clusters many data files, given as a list of (data file, list of numbers of clusters) as from read_manifest.
+    Each file is loaded once and clustered for all of its numbers of clusters in one task, and the tasks run in a pool
+    of n_jobs processes (None for all cpus), the largest files first. settings is a dict of kmeans attributes, e.g.
+    {"algorithm": "elkan"}. The result of each clustering is written to output_dir as <name of data file>_k<K> with
+    the extension of format, and every clustering starts from seed, so the results do not depend on the process
+    that runs them. Returns a dict for each clustering, in the order of jobs, with its timings and sum-of-squares
+    (sse), or the error if it failed, e.g. for a missing data file. With instrument=True the dicts also hold the statistics
+    of the clustering'''
+    if format not in _BATCH_EXTENSIONS:
+        raise ValueError("Unknown output format: " + str(format))
+    names = [os.path.splitext(os.path.basename(filename))[0] for filename, _ in jobs]
+    if len(set(names)) < len(names):
+        raise ValueError("The data files must have different names, as the outfiles are named after them")
+    os.makedirs(output_dir, exist_ok = True)
+    tasks = [(filename, list(numbers), os.path.join(output_dir, name), dict(settings or {}), format, seed, instrument)
+             for (filename, numbers), name in zip(jobs, names)]
+    # A missing data file is marked as an error in its rows, the other files are still clustered
+    results = [None] * len(tasks)
+    found = list()
+    for i, (filename, numbers, *_) in enumerate(tasks):
+        if os.path.isfile(filename):
+            found.append(i)
+        else:
+            results[i] = [{"file": filename, "clusters": K, "error": "Data file not found"} for K in numbers]
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+    if n_jobs == 1 or len(found) <= 1:
+        for i in found:
+            results[i] = _batch_task(tasks[i])
     else:
-        sys.stderr.write("Usage: cluster.py <datafilename> <number of clusters> <name of outfile if wanted> \n")
-        sys.exit(1)
+        with concurrent.futures.ProcessPoolExecutor(max_workers = min(n_jobs, len(found))) as pool:
+            # Starting with the largest files keeps a large file from being the last task left running
+            order = sorted(found, key = lambda i: -os.path.getsize(tasks[i][0]))
+            futures = {i: pool.submit(_batch_task, tasks[i]) for i in order}
+            for i in found:
+                results[i] = futures[i].result()
+    return [row for rows in results for row in rows]
+
+
+def _batch_task(task):
+    '''Entry point of the batch worker processes: loads one data file and clusters and writes it for each of its numbers of clusters'''
+    filename, numbers, output_prefix, settings, format, seed, instrument = task
+    my_kmeans = kmeans(seed = seed)
+    for name, value in settings.items():
+        setattr(my_kmeans, name, value)
+    # The stage timers of the instrumentation give the timings of the summary
+    my_kmeans.instrument = True
+    try:
+        my_kmeans.load(filename)
+    except (ValueError, OSError) as err:
+        return [{"file": filename, "clusters": K, "error": str(err)} for K in numbers]
+    except SystemExit:
+        # load has already printed why the file could not be read
+        return [{"file": filename, "clusters": K, "error": "the data file could not be read"} for K in numbers]
+    load_seconds = my_kmeans.stats["timers"]["load"]
+    rows = list()
+    for K in numbers:
+        row = {"file": filename, "clusters": K, "points": my_kmeans.data.shape[0], "dims": my_kmeans.data.shape[1], "load_seconds": load_seconds}
+        rows.append(row)
+        my_kmeans.reset_stats()
+        my_kmeans.clusters = K
+        outfile = output_prefix + "_k" + str(K) + _BATCH_EXTENSIONS[format]
+        try:
+            my_kmeans.cluster()
+            # write prints a message for every file, errors are raised and recorded in the row
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                my_kmeans.write(outfile, format = format)
+        except (ValueError, OSError) as err:
+            row["error"] = str(err)
+            continue
+        timers = my_kmeans.stats["timers"]
+        row.update(iterations = my_kmeans.n_iter, cluster_seconds = timers["cluster"], write_seconds = timers["write"],
+                   sse = my_kmeans.inertia, outfile = outfile)
+        if instrument:
+            row["stats"] = my_kmeans.stats
+    return rows
+
+
+def _format_summary(rows):
+    '''Formats the dicts returned by run_batch as a tab separated table with a header line'''
+    lines = ["file\tK\tpoints\titerations\tload (s)\tcluster (s)\twrite (s)\tSSE\toutfile"]
+    for row in rows:
+        if "error" in row:
+            lines.append(f"{row['file']}\t{row['clusters']}\t{row.get('points', '')}\t\t\t\t\t\terror: {row['error']}")
+        else:
+            lines.append(f"{row['file']}\t{row['clusters']}\t{row['points']}\t{row['iterations']}\t{row['load_seconds']:.4f}\t"
+                         f"{row['cluster_seconds']:.4f}\t{row['write_seconds']:.4f}\t{row['sse']}\t{row['outfile']}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Clusters the data points of a .lst file with k-means. "
+                                     "With --manifest or --glob many files are clustered in a pool of processes.",
+                                     epilog = "See README.md for more information.")
+    parser.add_argument("filename", nargs = "?", help = "the data file")
+    parser.add_argument("clusters", nargs = "?", help = "the number of clusters, or auto to choose it with --criterion")
+    parser.add_argument("outfilename", nargs = "?", help = "the outfile (standard output if it is not given)")
+    parser.add_argument("--criterion", choices = ["elbow", "gap", "silhouette"], default = "silhouette",
+                        help = "criterion used to choose the number of clusters with auto (default: silhouette)")
+    parser.add_argument("--minibatch", action = "store_true", help = "use the mini-batch algorithm (same as --algorithm=minibatch)")
+    parser.add_argument("--batch_size", type = int, help = "number of points per batch of the mini-batch algorithm (default: 1024)")
+    parser.add_argument("--algorithm", choices = ["lloyd", "hamerly", "elkan", "minibatch"], help = "clustering algorithm (default: lloyd)")
+    parser.add_argument("--n_init", type = int, help = "number of runs from different seeds, the best is kept")
+    parser.add_argument("--n_jobs", type = int,
+                        help = "number of processes for the runs of --n_init, or for the data files in batch mode (default: all cpus)")
+    parser.add_argument("--dtype", choices = ["float64", "float32"], help = "type of the loaded data, float32 halves the memory (default: float64)")
+    parser.add_argument("--seed", type = int, help = "seed of the random initialisation (0 in batch mode if it is not given)")
+    parser.add_argument("--format", choices = ["text", "labels", "npz", "columns"],
+                        help = "output format (by default chosen from the extension of the outfile, or text in batch mode)")
+    parser.add_argument("--stats", action = "store_true", help = "write the timers and counters of the run as JSON to standard error")
+    batch = parser.add_argument_group("batch mode")
+    inputs = batch.add_mutually_exclusive_group()
+    inputs.add_argument("--manifest", help = "file with a data file and its numbers of clusters on each line")
+    inputs.add_argument("--glob", help = "pattern of the data files, e.g. 'data/*.lst'")
+    batch.add_argument("--clusters", type = int, nargs = "+", dest = "batch_clusters", metavar = "K",
+                       help = "numbers of clusters of the files of --glob, or of the lines of the manifest without them")
+    batch.add_argument("--output_dir", default = "batch_output", help = "directory of the outfiles (default: batch_output)")
+    batch.add_argument("--summary", help = "file the summary table is written to (default: summary.tsv in the output directory)")
+    # Options may come before, between or after the positional arguments
+    args = parser.parse_intermixed_args()
+
+    # Settings of the clustering from the options
+    settings = dict()
+    if args.minibatch:
+        settings["algorithm"] = "minibatch"
+    if args.batch_size is not None:
+        settings["batch_size"] = args.batch_size
+    if args.algorithm is not None:
+        settings["algorithm"] = args.algorithm
+    if args.n_init is not None:
+        settings["n_init"] = args.n_init
+    if args.dtype is not None:
+        settings["dtype"] = args.dtype
+
+    if args.manifest is not None or args.glob is not None:
+        if args.filename is not None:
+            parser.error("a data file cannot be given together with --manifest or --glob")
+        try:
+            if args.manifest is not None:
+                jobs = read_manifest(args.manifest, args.batch_clusters or ())
+            else:
+                if not args.batch_clusters:
+                    parser.error("--glob needs the numbers of clusters (--clusters)")
+                jobs = [(filename, args.batch_clusters) for filename in sorted(glob.glob(args.glob, recursive = True))]
+                if not jobs:
+                    parser.error("no data files match " + args.glob)
+            rows = run_batch(jobs, args.output_dir, settings, args.format or "text", args.n_jobs,
+                             0 if args.seed is None else args.seed, instrument = args.stats)
+        except (ValueError, OSError) as err:
+            sys.stderr.write(str(err) + "\n")
+            sys.exit(1)
+        summary = _format_summary(rows)
+        sys.stdout.write(summary)
+        summary_file = args.summary if args.summary is not None else os.path.join(args.output_dir, "summary.tsv")
+        with open(summary_file, "w") as outfile:
+            outfile.write(summary)
+        if args.stats:
+            sys.stderr.write(json.dumps(rows, indent = 2) + "\n")
+        sys.exit(1 if any("error" in row for row in rows) else 0)
+
+    # A single data file. Missing arguments are an error instead of a prompt, so the script never waits for input
+    if args.filename is None or args.clusters is None:
+        parser.error("a data file and the number of clusters are needed, or --manifest or --glob for batch mode")
+    if args.format in ("npz", "columns") and args.outfilename is None:
+        parser.error("an outfile is needed for the " + args.format + " format")
+    filename, clusters, outfilename, criterion = args.filename, args.clusters, args.outfilename, args.criterion
     # Running kmeans algorithm with provided arguments (data, number of clusters, name of outfile if wanted)
-    my_kmeans = kmeans()
+    my_kmeans = kmeans(seed = args.seed)
+    for name, value in settings.items():
+        setattr(my_kmeans, name, value)
+    if args.n_jobs is not None:
+        my_kmeans.n_jobs = args.n_jobs
+    my_kmeans.instrument = args.stats
     my_kmeans.load(filename)
+    if clusters == "auto":
+        # Choose the number of clusters automatically, the cached clustering for the chosen K is the starting point
+        from choose_k_extension import kselector
+        selector = kselector(my_kmeans, n_jobs=my_kmeans.n_jobs)
+        clusters = str(selector.choose(criterion))
+        my_kmeans.init = selector.results[int(clusters)]["centroids"]
+        sys.stderr.write("Chosen number of clusters (" + criterion + "): " + clusters + "\n")
     if not clusters.isdigit():
         sys.stderr.write("Number of clusters must be an integer\n")
         sys.exit(1)
     my_kmeans.clusters = int(clusters)
     my_kmeans.cluster()
-    my_kmeans.write(outfilename)
+    try:
+        my_kmeans.write(outfilename, format = args.format)
+    except OSError as err:
+        print(err)
+        sys.exit(1)
+    if my_kmeans.instrument:
+        # The statistics go to standard error so they do not mix with the clustering written to standard output
+        sys.stderr.write(my_kmeans.stats_json() + "\n")
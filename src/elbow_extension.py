@@ -3,28 +3,57 @@
 import sys 
 import numpy as np 
 import matplotlib.pyplot as plt
-from cluster import kmeans 
+from cluster import kmeans
 
 
 def calculate_E(kmeans_instance):
     # Calculate the sum-of-squares distances (E) for the current clustering
-    E = 0
-    for i, key in enumerate(kmeans_instance.cluster_dict.keys()):
-        centroid = kmeans_instance.centroids[i]
-        for index in kmeans_instance.cluster_dict[key]:
-            E += np.sum((kmeans_instance.data[index] - centroid) ** 2)
-    return E
+    # The vectorized engine computes it from the label array when clustering, so the points are not walked again here
+    # There is no result after partial_fit, cluster_stream or load_model, only after cluster
+    if kmeans_instance.result is None:
+        raise ValueError("No clusters have been assigned. Please run the cluster method before calculating E.")
+    return kmeans_instance.result.inertia
 
 
-def elbow_plot(kmeans_instance, max_clusters):
-    # Generate an elbow plot for the given kmeans instance
+def _split_largest_cluster(data, labels, centroids):
+    # Warm start for K+1 clusters: the cluster with the highest sum-of-squares is split in two along its main axis,
+    # the two new centroids are placed where the means of the two halves of a normal distribution would be
+    point_E = np.sum((data - centroids[labels]) ** 2, axis=1)
+    largest = np.argmax(np.bincount(labels, weights=point_E, minlength=len(centroids)))
+    points = data[labels == largest]
+    if len(points) < 2:
+        # Nothing to split, start the new cluster at the point farthest from its centroid instead
+        return np.vstack([centroids, data[np.argmax(point_E)]])
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(points.T).reshape(points.shape[1], points.shape[1]))
+    offset = np.sqrt(2 * max(eigenvalues[-1], 0) / np.pi) * eigenvectors[:, -1]
+    new_centroids = np.vstack([centroids, centroids[largest] + offset])
+    new_centroids[largest] -= offset
+    return new_centroids
+
+
+def elbow_sweep(kmeans_instance, max_clusters, n_jobs=1, warm_start=False):
+    # Cluster the loaded data for K = 1 to max_clusters and return the sum-of-squares (E) for each K
+    # With n_jobs > 1 the values of K are clustered in parallel processes that share one copy of the data.
+    # With warm_start=True each K starts from the solution for K-1 with its largest cluster split in two,
+    # so the values of K are clustered one after another
+    if not warm_start:
+        results = kmeans_instance.cluster_many([{"clusters": K} for K in range(1, max_clusters + 1)], n_jobs=n_jobs)
+        return [result["inertia"] for result in results]
     E_values = list()
-    for num_clusters in range(1, max_clusters + 1):
-        print(num_clusters)
-        kmeans_instance.clusters = num_clusters
-        kmeans_instance.cluster()
-        E = calculate_E(kmeans_instance)
-        E_values.append(E)   
+    centroids = None
+    for K in range(1, max_clusters + 1):
+        settings = {"clusters": K}
+        if centroids is not None:
+            settings["init"] = _split_largest_cluster(kmeans_instance.data, labels, centroids)
+        result = kmeans_instance.cluster_many([settings])[0]
+        labels, centroids = result["labels"], result["centroids"]
+        E_values.append(result["inertia"])
+    return E_values
+
+
+def plot_elbow(E_values):
+    # Generate an elbow plot of the sum-of-squares for K = 1, 2, ...
+    max_clusters = len(E_values)
     plt.plot(range(1, max_clusters + 1), E_values, marker='o')
     plt.xlabel('Number of clusters (K)')
     plt.ylabel('Sum-of-Squares (E)')
@@ -39,16 +68,46 @@ def elbow_plot(kmeans_instance, max_clusters):
     plt.close()
 
 
+def elbow_plot(kmeans_instance, max_clusters, n_jobs=1, warm_start=False):
+    # Generate an elbow plot for the given kmeans instance
+    E_values = elbow_sweep(kmeans_instance, max_clusters, n_jobs=n_jobs, warm_start=warm_start)
+    plot_elbow(E_values)
+    return E_values
+
+
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
+    # Options start with "--", the remaining arguments are positional
+    options = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    arguments = [sys.argv[0]] + [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(arguments) == 1:
         filename = input("Please enter a data file: ")
-    elif len(sys.argv) == 2:
-        filename = sys.argv[1]
+    elif len(arguments) == 2:
+        filename = arguments[1]
     else:
-        sys.stderr.write("Usage: elbow_extension.py <datafilename> \n")
+        sys.stderr.write("Usage: elbow_extension.py <datafilename> [--max_clusters=<K>] [--n_jobs=<processes>] [--warm_start] [--no_plot] \n")
         sys.exit(1)
+    max_clusters = 10  # Change max_clusters as needed
+    n_jobs = 1
+    warm_start = False
+    plot = True
+    for option in options:
+        if option.startswith("--max_clusters=") and option[len("--max_clusters="):].isdigit():
+            max_clusters = int(option[len("--max_clusters="):])
+        elif option.startswith("--n_jobs=") and option[len("--n_jobs="):].isdigit():
+            n_jobs = int(option[len("--n_jobs="):])
+        elif option == "--warm_start":
+            warm_start = True
+        elif option == "--no_plot":
+            plot = False
+        else:
+            sys.stderr.write("Unknown option: " + option + "\n")
+            sys.exit(1)
     # Running kmeans algorithm with provided data
     my_kmeans = kmeans()
     my_kmeans.load(filename)
-    # Generate elbow plot
-    elbow_plot(my_kmeans, max_clusters=10)  # Change max_clusters as needed
+    # Compute the sum-of-squares for each K and generate elbow plot
+    E_values = elbow_sweep(my_kmeans, max_clusters, n_jobs=n_jobs, warm_start=warm_start)
+    for K, E in enumerate(E_values, start=1):
+        print(f"{K}\t{E}")
+    if plot:
+        plot_elbow(E_values)
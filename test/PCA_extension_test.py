@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import sys
+import pytest
+import numpy as np
+testdata_path = '/Users/johan/Documents/UNIXandPython/222110Project/test/testdata/'
+code_path = '/Users/johan/Documents/UNIXandPython/222110Project/src/'
+sys.path.append(testdata_path)
+sys.path.append(code_path)
+import matplotlib
+matplotlib.use("Agg")
+from cluster import kmeans, read_blocks
+from PCA_extension import perform_pca, fit_pca, transform_pca
+
+# Making a fixture with the data that will be used in the test functions
+@pytest.fixture()    
+def data():
+    return kmeans(code_path + "../data/point1000.lst").data
+
+
+"""Testing the PCA methods"""
+
+# Testing that the eigh and incremental methods give the same result as standardizing, np.cov and np.linalg.eig
+@pytest.mark.parametrize("method", ["eigh", "incremental"])
+def test_pca_same_as_eig(data, method):
+    standardized_data = (data - data.mean(axis=0)) / data.std(axis=0)
+    eigenvalues, eigenvectors = np.linalg.eig(np.cov(standardized_data.T))
+    order = np.argsort(eigenvalues)[::-1]
+    expected = standardized_data @ eigenvectors[:, order[:2]]
+    pca_result, ratios = perform_pca(data, method=method, return_ratios=True)
+    assert pca_result.shape == (1000, 2)
+    # The sign of each principal axis is arbitrary
+    assert np.allclose(np.abs(pca_result), np.abs(expected))
+    assert np.allclose(ratios, eigenvalues[order[:2]] / eigenvalues.sum())
+
+# Testing the incremental method on a stream of blocks read from the file
+def test_pca_stream(data):
+    pca = fit_pca(read_blocks(code_path + "../data/point1000.lst", block_rows=77), n_components=3)
+    expected = fit_pca(data, n_components=3, method="eigh")
+    assert np.allclose(pca["components"], expected["components"])
+    assert np.allclose(transform_pca(data, pca), transform_pca(data, expected))
+
+# Testing perform_pca on a stream of blocks, which is read twice, and the error for a one-shot iterator
+def test_perform_pca_stream(data):
+    filename = code_path + "../data/point1000.lst"
+    pca_result, ratios = perform_pca(lambda: read_blocks(filename, block_rows=77), return_ratios=True)
+    expected, expected_ratios = perform_pca(data, return_ratios=True)
+    assert np.allclose(pca_result, expected) and np.allclose(ratios, expected_ratios)
+    assert np.allclose(perform_pca(list(read_blocks(filename, block_rows=77))), expected)
+    with pytest.raises(ValueError, match="perform_pca reads the data twice"):
+        perform_pca(read_blocks(filename))
+
+# Testing that float32 data gives the same principal components as float64 data
+def test_pca_float32(data):
+    pca = fit_pca(data.astype(np.float32))
+    expected = fit_pca(data)
+    assert np.allclose(pca["components"], expected["components"], atol=1e-6)
+    assert np.allclose(pca["explained_variance_ratio"], expected["explained_variance_ratio"])
+
+# Testing the randomized method on wide data with a few dominating components
+def test_pca_randomized():
+    rng = np.random.default_rng(0)
+    wide_data = (rng.normal(size=(500, 10)) * (2.0 ** -np.arange(10))) @ rng.normal(size=(10, 800)) + 0.01 * rng.normal(size=(500, 800))
+    pca = fit_pca(wide_data, n_components=4, method="auto")
+    expected = fit_pca(wide_data, n_components=4, method="eigh")
+    assert np.allclose(pca["explained_variance_ratio"], expected["explained_variance_ratio"])
+    assert np.allclose(transform_pca(wide_data, pca), transform_pca(wide_data, expected), atol=1e-8)
+    assert expected["explained_variance_ratio"].sum() <= 1
+
+# Testing if correct ValueErrors are raised for an invalid number of components or method
+def test_pca_errors(data):
+    with pytest.raises(ValueError, match="Number of components must be between 1 and the number of dimensions"):
+        fit_pca(data, n_components=4)
+    with pytest.raises(ValueError, match="Unknown PCA method: svd"):
+        fit_pca(data, method="svd")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import sys
+import subprocess
+import pytest
+import numpy as np
+testdata_path = '/Users/johan/Documents/UNIXandPython/222110Project/test/testdata/'
+code_path = '/Users/johan/Documents/UNIXandPython/222110Project/src/'
+sys.path.append(testdata_path)
+sys.path.append(code_path)
+from cluster import kmeans
+from choose_k_extension import kselector, silhouette_score, knee
+
+# Making a fixture with four well separated clusters that will be used in the test functions
+@pytest.fixture()    
+def blobs():
+    rng = np.random.default_rng(0)
+    centers = np.array([[0, 0, 0], [10, 0, 0], [0, 10, 0], [0, 0, 10]], dtype=np.float64)
+    my_kmeans = kmeans(seed=0)
+    my_kmeans.data = centers[rng.integers(4, size=2000)] + rng.normal(size=(2000, 3))
+    return my_kmeans
+
+
+"""Testing the scores"""
+
+# Testing the vectorized silhouette score against a direct computation
+def test_silhouette_score():
+    rng = np.random.default_rng(1)
+    points = rng.random((30, 2))
+    labels = rng.integers(3, size=30)
+    expected = list()
+    for i in range(30):
+        distances = np.sqrt(np.sum((points - points[i]) ** 2, axis=1))
+        same = (labels == labels[i]) & (np.arange(30) != i)
+        a = distances[same].mean()
+        b = min(distances[labels == other].mean() for other in set(labels) if other != labels[i])
+        expected.append((b - a) / max(a, b))
+    assert np.isclose(silhouette_score(points, labels), np.mean(expected))
+
+# Testing the knee of a curve
+def test_knee():
+    assert knee([1, 2, 3, 4, 5, 6], [100, 50, 20, 18, 16, 15]) == 3
+    assert knee([1, 2], [100, 50]) == 1
+
+
+
+"""Testing the kselector class"""
+
+# Testing that all criteria find the four clusters
+@pytest.mark.parametrize("criterion", ["elbow", "gap", "silhouette"])
+def test_choose(blobs, criterion):
+    assert kselector(blobs, max_clusters=8).choose(criterion) == 4
+
+# Testing that the clustering of each K is only done once for all criteria
+def test_cache(blobs):
+    selector = kselector(blobs, max_clusters=6)
+    calls = list()
+    cluster_many = blobs.cluster_many
+    blobs.cluster_many = lambda settings, *args, **kwargs: calls.append(len(settings)) or cluster_many(settings, *args, **kwargs)
+    selector.choose("silhouette")
+    selector.choose("elbow")
+    selector.choose("gap")
+    assert calls == [5, 1]
+    assert sorted(selector.results.keys()) == [1, 2, 3, 4, 5, 6]
+
+# Testing if correct ValueError is raised for an unknown criterion
+def test_unknown_criterion(blobs):
+    with pytest.raises(ValueError, match="Unknown criterion: best"):
+        kselector(blobs).choose("best")
+
+# Testing the auto option of the cluster.py command line
+def test_cluster_auto(blobs, tmp_path):
+    np.savetxt(tmp_path / "blobs.lst", blobs.data, delimiter="\t", fmt="%.4f")
+    result = subprocess.run([sys.executable, code_path + "cluster.py", str(tmp_path / "blobs.lst"), "auto", str(tmp_path / "output.lst")],
+                            capture_output=True, text=True, cwd=code_path)
+    assert result.returncode == 0, result.stderr
+    assert "Chosen number of clusters (silhouette): 4" in result.stderr
+    assert open(tmp_path / "output.lst").read().count("Cluster-") == 4
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import sys
+import os
+import subprocess
+import json
+import threading
+import concurrent.futures
 import pytest
 import numpy as np
 testdata_path = '/Users/johan/Documents/UNIXandPython/222110Project/test/testdata/'
 code_path = '/Users/johan/Documents/UNIXandPython/222110Project/src/'
 sys.path.append(testdata_path)
 sys.path.append(code_path)
-from cluster import kmeans
+from cluster import kmeans, read_blocks, read_columns, read_manifest, run_batch, _rebatch
 
 # Making a fixture that will be used to call the kmeans class in all test functions
 @pytest.fixture()    
@@ -70,6 +75,41 @@ def test_load_missing_row(mykmeans):
     assert len(ids) == 99
 
 
+# Testing that the values and ids are parsed correctly for tab and comma seperated files
+def test_load_values(mykmeans):
+    data, ids = mykmeans.load(testdata_path + "comma_sep.lst")
+    tab_data, tab_ids = kmeans().load(testdata_path + "point100_tab.lst")
+    assert data.dtype == np.float64 and data.flags["C_CONTIGUOUS"]
+    assert ids[:3] == ["Point00", "Point01", "Point02"]
+    assert np.array_equal(data[0], [0.2605, 0.6913, 0.2874, 0.4148])
+    assert np.array_equal(data, tab_data[:len(data)]) and ids == tab_ids[:len(ids)]
+
+# Testing that the sidecar cache is written, reused and invalidated when the data file changes
+def test_load_cache(mykmeans, tmp_path):
+    datafile = tmp_path / "points.lst"
+    lines = open(testdata_path + "point100_tab.lst").readlines()
+    datafile.write_text("".join(lines[:50]))
+    data, ids = mykmeans.load(str(datafile), cache=True)
+    assert (tmp_path / "points.lst.npz").exists()
+    cached_data, cached_ids = kmeans().load(str(datafile), cache=True)
+    assert np.array_equal(data, cached_data) and ids == cached_ids
+    datafile.write_text("".join(lines))
+    new_data, new_ids = kmeans().load(str(datafile), cache=True)
+    assert len(new_data) == 100 and len(new_ids) == 100
+
+# Testing that float32 data is parsed directly as float32, also for the cache and data on disk, and that other types are refused
+def test_load_float32(tmp_path):
+    datafile = tmp_path / "points.lst"
+    datafile.write_text(open(testdata_path + "point100_tab.lst").read())
+    data, ids = kmeans().load(str(datafile), cache=True)
+    for options in ({}, {"cache": True}, {"mmap": True}):
+        data32, ids32 = kmeans(dtype="float32").load(str(datafile), **options)
+        assert data32.dtype == np.float32 and np.array_equal(np.asarray(data32), data.astype(np.float32))
+        assert list(ids32[:len(ids32)]) == ids
+    assert kmeans().load(str(datafile), mmap=True)[0].dtype == np.float64
+    with pytest.raises(ValueError, match="Unknown dtype: float16"):
+        kmeans(dtype="float16").load(str(datafile))
+
 
 """Testing cluster function in kmeans class"""
 
@@ -106,6 +146,540 @@ def test_cluster_no_data(mykmeans):
         mykmeans.cluster()
 
 
+# Testing that every point is assigned to its nearest centroid and that cluster_dict matches the labels
+def test_cluster_assignment(mykmeans):
+    mykmeans.load(testdata_path + "point100_tab.lst")
+    mykmeans.clusters = 3
+    cluster_dict, centroids = mykmeans.cluster()
+    assert list(cluster_dict.keys()) == ["Cluster-1", "Cluster-2", "Cluster-3"]
+    assert sorted(index for indices in cluster_dict.values() for index in indices) == list(range(100))
+    for i, key in enumerate(cluster_dict.keys()):
+        assert np.all(mykmeans.labels[cluster_dict[key]] == i)
+        assert np.allclose(centroids[i], mykmeans.data[cluster_dict[key]].mean(axis=0), atol=0.001)
+
+# Testing that the result holds the labels, counts and sorted indices of the clusters as arrays
+def test_cluster_result(mykmeans):
+    mykmeans.load(testdata_path + "point100_tab.lst")
+    mykmeans.clusters = 3
+    mykmeans.cluster()
+    result = mykmeans.result
+    assert result.labels.dtype == np.int32 and result.centroids.shape == (3, mykmeans.data.shape[1])
+    assert result.counts.tolist() == np.bincount(result.labels, minlength=3).tolist()
+    assert result.offsets.tolist() == [0] + np.cumsum(result.counts).tolist()
+    for i in range(3):
+        assert np.array_equal(result.indices(i), np.flatnonzero(result.labels == i))
+    assert result.inertia == mykmeans.inertia
+    assert dict(mykmeans.cluster_dict) == {"Cluster-" + str(i+1): np.flatnonzero(result.labels == i).tolist() for i in range(3)}
+    with pytest.raises(KeyError):
+        mykmeans.cluster_dict["Cluster-4"]
+
+# Testing that the result does not depend on the block size used for the distance computations
+def test_cluster_chunk_size(mykmeans):
+    mykmeans.load(testdata_path + "point100_tab.lst")
+    mykmeans.clusters = 4
+    np.random.seed(1)
+    cluster_dict, centroids = mykmeans.cluster()
+    mykmeans.chunk_size = 7
+    np.random.seed(1)
+    chunked_dict, chunked_centroids = mykmeans.cluster()
+    assert cluster_dict == chunked_dict
+    # The points are summed in blocks of different sizes, which can change the last bits of the means
+    assert np.allclose(centroids, chunked_centroids, rtol=1e-12, atol=0)
+
+# Testing that the distances computed from the norms and a matrix product are the squared euclidian distances
+def test_squared_distances(mykmeans):
+    rng = np.random.default_rng(0)
+    block, centroids = rng.normal(size=(50, 4)), rng.normal(size=(3, 4))
+    expected = np.sum((block[:, np.newaxis, :] - centroids[np.newaxis, :, :]) ** 2, axis=2)
+    assert np.allclose(mykmeans._squared_distances(block, centroids), expected)
+    assert np.all(mykmeans._squared_distances(block, block)[np.arange(50), np.arange(50)] >= 0)
+
+# Testing that the result is exactly the same with any number of threads
+@pytest.mark.parametrize("algorithm", ["lloyd", "hamerly", "elkan"])
+def test_cluster_n_threads(algorithm):
+    results = list()
+    for n_threads in (1, 3):
+        my_kmeans = kmeans(testdata_path + "point100_tab.lst", 4, seed=0, algorithm=algorithm)
+        my_kmeans.chunk_size = 9
+        my_kmeans.n_threads = n_threads
+        my_kmeans.cluster()
+        results.append((my_kmeans.labels, np.array(my_kmeans.centroids), my_kmeans.inertia, my_kmeans.distance_evaluations))
+    assert np.array_equal(results[0][0], results[1][0]) and np.array_equal(results[0][1], results[1][1])
+    assert results[0][2] == results[1][2] and results[0][3] == results[1][3]
+
+# Testing that the bounded algorithms use the norms of the points computed once per fit
+@pytest.mark.parametrize("algorithm", ["lloyd", "hamerly", "elkan"])
+def test_cluster_bounds_use_norms(monkeypatch, algorithm):
+    missing = list()
+    squared_distances = kmeans._squared_distances
+    def record_norms(self, block, centroids, block_norms = None):
+        if block is not centroids and block_norms is None:
+            missing.append(block.shape[0])
+        return squared_distances(self, block, centroids, block_norms)
+    monkeypatch.setattr(kmeans, "_squared_distances", record_norms)
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 4, seed=0, algorithm=algorithm)
+    my_kmeans.chunk_size = 9
+    my_kmeans.cluster()
+    assert missing == []
+
+# Testing that a fit makes one pool of threads and that the assignment of the bounded algorithms runs in it
+@pytest.mark.parametrize("algorithm", ["lloyd", "hamerly", "elkan"])
+def test_cluster_thread_pool(monkeypatch, algorithm):
+    pools = list()
+    executor = concurrent.futures.ThreadPoolExecutor
+    def make_pool(*args, **kwargs):
+        pools.append(executor(*args, **kwargs))
+        return pools[-1]
+    monkeypatch.setattr(concurrent.futures, "ThreadPoolExecutor", make_pool)
+    threads = set()
+    block_sums = kmeans._block_sums
+    def record_thread(self, block, block_labels):
+        threads.add(threading.get_ident())
+        return block_sums(self, block, block_labels)
+    monkeypatch.setattr(kmeans, "_block_sums", record_thread)
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 4, seed=0, algorithm=algorithm)
+    my_kmeans.chunk_size = 9
+    my_kmeans.n_threads = 3
+    my_kmeans.cluster()
+    assert len(pools) == 1 and my_kmeans._pool is None
+    assert threads and threading.get_ident() not in threads
+
+# Testing that an explicit seed gives reproducible results for all initialisation methods
+@pytest.mark.parametrize("init", ["k-means++", "k-means||", "random"])
+def test_cluster_seed_reproducible(init):
+    first = kmeans(testdata_path + "point100_tab.lst", 3, seed=7, init=init)
+    second = kmeans(testdata_path + "point100_tab.lst", 3, seed=np.random.default_rng(7), init=init)
+    cluster_dict, centroids = first.cluster()
+    assert first.cluster()[0] == cluster_dict
+    assert np.array_equal(first.centroids, centroids)
+    assert np.array_equal(first._pick_centroids(), second._pick_centroids())
+
+# Testing that the seeding methods pick the desired amount of distinct data points
+def test_pick_centroids_distinct(mykmeans):
+    mykmeans.load(testdata_path + "point100_tab.lst")
+    mykmeans.clusters = 10
+    rng = np.random.default_rng(0)
+    for centroids in (mykmeans._pick_centroids_kmeans_plusplus(rng), mykmeans._pick_centroids_kmeans_parallel(rng)):
+        assert len(np.unique(np.array(centroids), axis=0)) == 10
+        assert all(any(np.array_equal(centroid, row) for row in mykmeans.data) for centroid in centroids)
+
+# Testing if correct ValueError is raised for an unknown initialisation method
+def test_cluster_unknown_init(mykmeans):
+    mykmeans.load(testdata_path + "point100_tab.lst")
+    mykmeans.clusters = 3
+    mykmeans.init = "first"
+    with pytest.raises(ValueError, match="Unknown initialisation method: first"):
+        mykmeans.cluster()
+
+# Testing if correct ValueError is raised for an unknown algorithm
+def test_cluster_unknown_algorithm(mykmeans):
+    mykmeans.load(testdata_path + "point100_tab.lst")
+    mykmeans.clusters = 3
+    mykmeans.algorithm = "fastest"
+    with pytest.raises(ValueError, match="Unknown algorithm: fastest"):
+        mykmeans.cluster()
+
+# Testing that the algorithms with distance bounds give exactly the same result as Lloyd's algorithm
+@pytest.mark.parametrize("algorithm", ["hamerly", "elkan"])
+def test_cluster_bounds_same_as_lloyd(algorithm):
+    lloyd = kmeans(code_path + "../data/point1000.lst", 10, seed=2)
+    lloyd.chunk_size = 300
+    lloyd_dict, lloyd_centroids = lloyd.cluster()
+    bounded = kmeans(code_path + "../data/point1000.lst", 10, seed=2, algorithm=algorithm)
+    bounded.chunk_size = 300
+    bounded_dict, bounded_centroids = bounded.cluster()
+    assert bounded_dict == lloyd_dict
+    assert np.array_equal(bounded_centroids, lloyd_centroids)
+    assert bounded.n_iter == lloyd.n_iter
+    assert lloyd.skipped_distances == 0 and bounded.skipped_distances > 0
+    assert bounded.distance_evaluations + bounded.skipped_distances == lloyd.distance_evaluations
+    assert lloyd.bound_evaluations == 0 and bounded.bound_evaluations > 0
+
+# Testing that the skipped distances are never negative on wide data, where the bounds are rarely tight
+@pytest.mark.parametrize("algorithm", ["hamerly", "elkan"])
+def test_cluster_bounds_skipped_not_negative(algorithm):
+    my_kmeans = kmeans(clusters=8, seed=0, algorithm=algorithm)
+    my_kmeans.data = np.random.default_rng(0).random((3000, 64))
+    my_kmeans.max_iter = 3
+    my_kmeans.tol = 0
+    my_kmeans.cluster()
+    # Three iterations and the assignment to the final centroids
+    assert 0 <= my_kmeans.skipped_distances <= 3 * 3000 * 8
+    assert my_kmeans.distance_evaluations + my_kmeans.skipped_distances == 4 * 3000 * 8
+
+# Testing that an empty cluster is moved to the point farthest from its centroid instead of giving NaN
+def test_cluster_empty_cluster():
+    my_kmeans = kmeans(clusters=3, init=np.array([[0.0, 0.0], [10.0, 0.0], [1000.0, 1000.0]]))
+    my_kmeans.data = np.array([[0.0, 0.0], [0.0, 1.0], [1.0, 0.0], [10.0, 0.0], [10.0, 1.0], [30.0, 0.0]])
+    my_kmeans.cluster()
+    assert not np.any(np.isnan(my_kmeans.centroids))
+    assert np.array_equal(my_kmeans.centroids[2], [30.0, 0.0])
+    assert my_kmeans.result.counts.tolist() == [3, 2, 1]
+
+# Testing that max_iter limits the iterations and that the time and inertia of every iteration are kept
+def test_cluster_max_iter_and_history():
+    my_kmeans = kmeans(code_path + "../data/point1000.lst", 10, seed=2)
+    my_kmeans.max_iter = 3
+    my_kmeans.tol = 0
+    my_kmeans.cluster()
+    assert my_kmeans.n_iter == 3
+    assert len(my_kmeans.iteration_times) == 3 and len(my_kmeans.inertia_history) == 3
+    assert all(later <= earlier * (1 + 1e-12) for earlier, later in zip(my_kmeans.inertia_history, my_kmeans.inertia_history[1:]))
+    assert my_kmeans.inertia <= my_kmeans.inertia_history[-1] * (1 + 1e-12)
+
+# Testing that without a tolerance the clustering stops when no point changes cluster
+def test_cluster_no_label_changes():
+    my_kmeans = kmeans(code_path + "../data/point1000.lst", 10, seed=2)
+    my_kmeans.tol = 0
+    my_kmeans.cluster()
+    assert my_kmeans.n_iter < my_kmeans.max_iter
+    assert np.array_equal(my_kmeans.predict(my_kmeans.data), my_kmeans.labels)
+    assert np.isclose(my_kmeans.inertia_history[-1], my_kmeans.inertia)
+
+# Testing that the sum-of-squares of every iteration is accurate for data far from the origin
+def test_cluster_inertia_history_offset():
+    my_kmeans = kmeans(code_path + "../data/point1000.lst", 8, seed=0)
+    my_kmeans.data = my_kmeans.data + 1e8
+    my_kmeans.convergence = "inertia"
+    my_kmeans.cluster()
+    assert my_kmeans.n_iter > 2
+    assert np.isclose(my_kmeans.inertia_history[-1], my_kmeans.inertia, rtol=1e-3)
+    my_kmeans.tol = 0
+    my_kmeans.cluster()
+    assert np.isclose(my_kmeans.inertia_history[-1], my_kmeans.inertia, rtol=1e-6)
+
+# Testing that a maximum number of iterations below 1 and a negative tolerance are rejected
+@pytest.mark.parametrize("name, value", [("max_iter", 0), ("max_iter", -3), ("max_iter", 2.5), ("tol", -1e-4), ("tol", float("nan"))])
+def test_cluster_invalid_stopping(name, value):
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 3, seed=0)
+    setattr(my_kmeans, name, value)
+    with pytest.raises(ValueError):
+        my_kmeans.cluster()
+
+# Testing that the labels belong to the final centroids when the clustering stops on the tolerance
+@pytest.mark.parametrize("algorithm", ["lloyd", "hamerly", "elkan"])
+@pytest.mark.parametrize("convergence", ["shift", "inertia"])
+def test_cluster_tolerance_final_labels(algorithm, convergence):
+    my_kmeans = kmeans(code_path + "../data/point10000.lst", 20, seed=0, algorithm=algorithm)
+    my_kmeans.convergence = convergence
+    my_kmeans.cluster()
+    assert my_kmeans.n_iter < my_kmeans.max_iter
+    assert np.array_equal(my_kmeans.predict(my_kmeans.data), my_kmeans.labels)
+    assert np.isclose(my_kmeans.inertia, my_kmeans._inertia(my_kmeans.labels, np.array(my_kmeans.centroids)))
+
+# Testing the tolerance on the relative change of the inertia and the error for an unknown criterion
+def test_cluster_inertia_convergence():
+    my_kmeans = kmeans(code_path + "../data/point1000.lst", 10, seed=2)
+    my_kmeans.convergence = "inertia"
+    my_kmeans.tol = 1e-2
+    my_kmeans.cluster()
+    history = my_kmeans.inertia_history
+    assert abs(history[-2] - history[-1]) <= 1e-2 * history[-2]
+    assert all(abs(earlier - later) > 1e-2 * earlier for earlier, later in zip(history[:-2], history[1:-1]))
+    my_kmeans.convergence = "labels"
+    with pytest.raises(ValueError, match="Unknown convergence criterion: labels"):
+        my_kmeans.cluster()
+
+# Testing that clustering float32 data gives the same labels as float64 data on the bundled data
+@pytest.mark.parametrize("datafile", ["point100.lst", "point1000.lst", "point4169.lst", "point5000.lst", "point10000.lst"])
+@pytest.mark.parametrize("algorithm", ["lloyd", "elkan"])
+def test_cluster_float32_same_labels(datafile, algorithm):
+    results = list()
+    for dtype in ("float64", "float32"):
+        my_kmeans = kmeans(code_path + "../data/" + datafile, 8, seed=0, algorithm=algorithm, dtype=dtype)
+        my_kmeans.cluster()
+        results.append(my_kmeans)
+    assert results[1].data.nbytes == results[0].data.nbytes // 2
+    assert np.array_equal(results[1].labels, results[0].labels)
+    assert np.allclose(results[1].centroids, results[0].centroids, rtol=1e-6)
+    assert np.isclose(results[1].inertia, results[0].inertia, rtol=1e-6)
+
+# Testing that the distances of float32 data are computed in float32 and that a stream is clustered with the dtype
+def test_cluster_float32_distances(monkeypatch):
+    my_kmeans = kmeans(code_path + "../data/point1000.lst", 8, seed=0, dtype="float32")
+    block = my_kmeans.data[:50]
+    distances = my_kmeans._squared_distances(block, np.asarray(my_kmeans.data[:8], dtype=np.float64))
+    assert distances.dtype == np.float32
+    assert np.allclose(distances, my_kmeans._squared_distances(block.astype(np.float64), np.asarray(my_kmeans.data[:8], dtype=np.float64)), rtol=1e-4, atol=1e-2)
+    batches = list()
+    minibatch_step = kmeans._minibatch_step
+    def record_batch(self, batch, centroids, counts):
+        batches.append(batch.dtype)
+        return minibatch_step(self, batch, centroids, counts)
+    monkeypatch.setattr(kmeans, "_minibatch_step", record_batch)
+    my_kmeans.batch_size = 100
+    my_kmeans.cluster_stream(read_blocks(code_path + "../data/point1000.lst", 77, np.float32))
+    assert batches and set(batches) == {np.dtype(np.float32)}
+
+# Testing that a mini-batch fit after a full batch fit on the same instance does not keep the history of the full batch fit
+def test_cluster_minibatch_history():
+    my_kmeans = kmeans(code_path + "../data/point1000.lst", 10, seed=2)
+    my_kmeans.cluster()
+    my_kmeans.algorithm = "minibatch"
+    my_kmeans.batch_size = 100
+    my_kmeans.cluster()
+    assert len(my_kmeans.iteration_times) == my_kmeans.n_iter
+    assert my_kmeans.inertia_history == []
+
+# Testing that the inertia is the sum of squared distances from the points to their centroids
+def test_cluster_inertia(mykmeans):
+    mykmeans.load(testdata_path + "point100_tab.lst")
+    mykmeans.clusters = 3
+    mykmeans.cluster()
+    expected = sum(np.sum((mykmeans.data[indices] - mykmeans.centroids[i]) ** 2) for i, indices in enumerate(mykmeans.cluster_dict.values()))
+    assert np.isclose(mykmeans.inertia, expected)
+    assert mykmeans.restarts == [{"inertia": mykmeans.inertia, "n_iter": mykmeans.n_iter}]
+
+# Testing that several runs keep the best one and give the same result in a process pool as in one process
+def test_cluster_restarts():
+    results = list()
+    for n_jobs in (1, 2):
+        my_kmeans = kmeans(code_path + "../data/point1000.lst", 8, seed=3)
+        my_kmeans.n_init = 4
+        my_kmeans.n_jobs = n_jobs
+        cluster_dict, centroids = my_kmeans.cluster()
+        assert len(my_kmeans.restarts) == 4
+        assert my_kmeans.inertia == min(run["inertia"] for run in my_kmeans.restarts)
+        assert np.isclose(my_kmeans.inertia, my_kmeans._inertia(my_kmeans.labels, np.array(centroids)))
+        results.append((cluster_dict, my_kmeans.restarts))
+    assert results[0] == results[1]
+    assert len(set(run["inertia"] for run in results[0][1])) > 1
+
+
+
+"""Testing the mini-batch algorithm of the kmeans class"""
+
+# Testing that mini-batch k-means ends close to the full batch result
+def test_minibatch_close_to_full_batch():
+    full = kmeans(code_path + "../data/point1000.lst", 5, seed=0)
+    full.cluster()
+    minibatch = kmeans(code_path + "../data/point1000.lst", 5, seed=0)
+    minibatch.algorithm = "minibatch"
+    minibatch.batch_size = 100
+    cluster_dict, centroids = minibatch.cluster()
+    assert sum(len(indices) for indices in cluster_dict.values()) == 1000
+    assert minibatch.n_iter <= minibatch.max_iter
+    sse = lambda my_kmeans: np.sum((my_kmeans.data - np.array(my_kmeans.centroids)[my_kmeans.labels]) ** 2)
+    assert sse(minibatch) < 1.1 * sse(full)
+
+# Testing that a stream of blocks can be clustered without loading the file
+def test_minibatch_stream():
+    my_kmeans = kmeans(clusters=3, seed=1)
+    my_kmeans.batch_size = 20
+    centroids = my_kmeans.cluster_stream(read_blocks(testdata_path + "point100_missing_row.lst", block_rows=7))
+    assert len(centroids) == 3 and my_kmeans.labels is None
+    assert my_kmeans.n_iter == 5  # 99 rows in batches of 20
+    data, ids = kmeans().load(testdata_path + "point100_missing_row.lst")
+    assert np.all(np.array(centroids) >= data.min(axis=0)) and np.all(np.array(centroids) <= data.max(axis=0))
+
+# Testing that blocks of any size are turned into batches of the right size
+def test_rebatch():
+    blocks = [np.ones((3, 2)), np.ones((10, 2)), np.ones(2)]
+    assert [len(batch) for batch in _rebatch(blocks, 4)] == [4, 4, 4, 2]
+    assert all(batch.dtype == np.float32 for batch in _rebatch(blocks, 4, np.float32))
+
+
+
+"""Testing out-of-core mode (mmap=True) of the kmeans class"""
+
+# Testing that clustering and writing data on disk gives the same output as data in memory
+def test_mmap_same_output(tmp_path):
+    datafile = str(tmp_path / "points.lst")
+    with open(datafile, "w") as outfile:
+        outfile.write(open(testdata_path + "point100_missing_row.lst").read())
+    outputs = list()
+    for mmap in (False, True):
+        my_kmeans = kmeans(clusters=4, seed=3)
+        my_kmeans.chunk_size = 7
+        my_kmeans.load(datafile, mmap=mmap)
+        my_kmeans.cluster()
+        my_kmeans.write(str(tmp_path / "output.lst"))
+        outputs.append(open(tmp_path / "output.lst").read())
+    assert (tmp_path / "points.lst.npy").exists() and (tmp_path / "points.lst.ids.npy").exists()
+    assert outputs[0] == outputs[1]
+
+# Testing that the text layout of data on disk is written with one pass over the data, also when the rows are spilled often
+def test_mmap_write_one_pass(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys.modules[kmeans.__module__], "_SPILL_CHARACTERS", 100)
+    datafile = str(tmp_path / "points.lst")
+    with open(datafile, "w") as outfile:
+        outfile.write(open(testdata_path + "point100_tab.lst").read())
+    expected = kmeans(datafile, 5, seed=1)
+    expected.chunk_size = 7
+    expected.cluster()
+    expected.write(str(tmp_path / "expected.lst"))
+    my_kmeans = kmeans(clusters=5, seed=1)
+    my_kmeans.chunk_size = 7
+    my_kmeans.load(datafile, mmap=True)
+    my_kmeans.cluster()
+    passes = list()
+    chunks = kmeans._chunks
+    def count_passes(self):
+        passes.append(1)
+        return chunks(self)
+    monkeypatch.setattr(kmeans, "_chunks", count_passes)
+    my_kmeans.write(str(tmp_path / "output.lst"))
+    assert len(passes) == 1
+    assert open(tmp_path / "output.lst").read() == open(tmp_path / "expected.lst").read()
+    assert sorted(os.listdir(tmp_path)) == ["expected.lst", "output.lst", "points.lst", "points.lst.ids.npy", "points.lst.npy"]
+
+# Testing that a failed conversion leaves no .npy files behind and that a truncated .npy file is converted again
+def test_mmap_failed_conversion(tmp_path):
+    lines = open(testdata_path + "point100_tab.lst").readlines()
+    datafile = tmp_path / "points.lst"
+    datafile.write_text("".join(lines[:90]) + "Point90\t0.1\t0.2\n" + "".join(lines[91:]))
+    with pytest.raises(ValueError, match="Inconsistent vector dimensions"):
+        kmeans().load(str(datafile), mmap=True)
+    assert sorted(os.listdir(tmp_path)) == ["points.lst"]
+    datafile.write_text("".join(lines))
+    kmeans().load(str(datafile), mmap=True)
+    with open(tmp_path / "points.lst.npy", "r+b") as npy_file:
+        npy_file.truncate(1000)
+    data, ids = kmeans().load(str(datafile), mmap=True)
+    assert data.shape == (100, 4) and np.array_equal(data[99], kmeans().load(str(datafile))[0][99])
+
+# Testing that a data set four times larger than the memory limit of the process can be clustered
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Needs /proc and RLIMIT_AS")
+def test_mmap_larger_than_memory(tmp_path):
+    datafile = str(tmp_path / "points.npy")
+    rows, dims, limit = 1000000, 32, 64 * 1024 * 1024
+    rng = np.random.default_rng(0)
+    centers = rng.random((3, dims)) * 10
+    # Write the data (256 MB) one block at a time
+    with open(datafile, "wb") as outfile:
+        np.lib.format.write_array_header_1_0(outfile, {"descr": "<f8", "fortran_order": False, "shape": (rows, dims)})
+        for start in range(0, rows, 100000):
+            outfile.write((centers[rng.integers(3, size=100000)] + rng.normal(size=(100000, dims))).tobytes())
+    # Cluster the data in a new process, where the address space may only grow by the limit after the imports
+    script = f'''
+import resource, sys
+sys.path.append({code_path!r})
+import numpy as np
+from cluster import kmeans, read_blocks, read_columns, _rebatch
+# The first large matrix product reserves a fixed work buffer in the BLAS library, which does not grow with the data
+np.ones((4096, 32)) @ np.ones((32, 1))
+vm = [int(line.split()[1]) * 1024 for line in open("/proc/self/status") if line.startswith("VmSize")][0]
+resource.setrlimit(resource.RLIMIT_AS, (vm + {limit}, vm + {limit}))
+my_kmeans = kmeans(clusters=3, seed=0)
+my_kmeans.load({datafile!r}, mmap=True)
+my_kmeans.cluster()
+print(*np.bincount(my_kmeans.labels))
+try:
+    np.load({datafile!r})
+except MemoryError:
+    print("Loading into memory failed")
+'''
+    env = dict(os.environ, OPENBLAS_NUM_THREADS="1", OMP_NUM_THREADS="1")
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env)
+    assert result.returncode == 0, result.stderr
+    counts, message = result.stdout.splitlines()
+    counts = [int(count) for count in counts.split()]
+    assert sum(counts) == rows and min(counts) > 300000
+    assert message == "Loading into memory failed"
+
+
+"""Testing online clustering (partial_fit) of the kmeans class"""
+
+# Testing that feeding point10000.lst in chunks gives a sum-of-squares within 5% of clustering all the data at once
+@pytest.mark.parametrize("block_rows", [500, 2000])
+def test_partial_fit_chunks(block_rows):
+    batch_kmeans = kmeans(code_path + "../data/point10000.lst", 5, seed=0)
+    batch_kmeans.cluster()
+    online_kmeans = kmeans(clusters=5, seed=0)
+    for block in read_blocks(code_path + "../data/point10000.lst", block_rows):
+        labels = online_kmeans.partial_fit(block)
+        assert labels.shape == (block.shape[0],)
+    assert online_kmeans.n_batches == 10000 // block_rows
+    online_inertia = batch_kmeans._inertia(online_kmeans.predict(batch_kmeans.data), np.array(online_kmeans.centroids))
+    assert online_inertia <= 1.05 * batch_kmeans.inertia
+
+# Testing that partial_fit continues from a fit and that decay=0 moves the centroids to the means of the new points
+def test_partial_fit_decay_and_drift(capsys):
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 3, seed=0)
+    my_kmeans.cluster()
+    centroids = np.array(my_kmeans.centroids)
+    my_kmeans.decay = 0.0
+    my_kmeans.drift_interval = 1
+    batch = my_kmeans.data[:20] + 1.0
+    labels = my_kmeans.partial_fit(batch)
+    for i in np.unique(labels):
+        assert np.allclose(my_kmeans.centroids[i], batch[labels == i].mean(axis=0))
+    assert np.allclose(my_kmeans.drift, np.linalg.norm(np.array(my_kmeans.centroids) - centroids, axis=1))
+    assert "Batch 1: largest centroid drift" in capsys.readouterr().err
+    assert my_kmeans.result is None
+
+# Testing if correct ValueError is raised when the first batch has fewer points than clusters
+def test_partial_fit_small_batch():
+    with pytest.raises(ValueError, match="The first batch must contain at least as many observations as clusters"):
+        kmeans(clusters=3).partial_fit(np.ones((2, 2)))
+
+
+"""Testing predict, transform and saved models of the kmeans class"""
+
+# Testing that predict gives the labels of the fit for arrays and files in blocks of any size
+def test_predict(tmp_path):
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 3, seed=0)
+    my_kmeans.cluster()
+    assert np.array_equal(my_kmeans.predict(my_kmeans.data), my_kmeans.labels)
+    my_kmeans.chunk_size = 7
+    assert np.array_equal(my_kmeans.predict(testdata_path + "point100_tab.lst"), my_kmeans.labels)
+    assert my_kmeans.predict(my_kmeans.data[0]).tolist() == [my_kmeans.labels[0]]
+
+# Testing that transform gives the distance from every point to every centroid
+def test_transform():
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 3, seed=0)
+    my_kmeans.chunk_size = 16
+    my_kmeans.cluster()
+    distances = my_kmeans.transform(my_kmeans.data)
+    expected = np.linalg.norm(my_kmeans.data[:, np.newaxis, :] - np.array(my_kmeans.centroids)[np.newaxis], axis=2)
+    assert distances.shape == (100, 3) and np.allclose(distances, expected)
+
+# Testing if correct ValueErrors are raised without a model or with points of the wrong dimensionality
+def test_predict_errors(mykmeans):
+    with pytest.raises(ValueError, match="No clusters have been assigned"):
+        mykmeans.predict(np.ones((2, 2)))
+    mykmeans.centroids = [np.zeros(2), np.ones(2)]
+    with pytest.raises(ValueError, match="The points have 3 dimensions, but the model has 2"):
+        mykmeans.predict(np.ones((2, 3)))
+
+# Testing that a saved model gives the same predictions and settings after loading it into a new instance
+def test_save_load_model(tmp_path):
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 3, seed=0, algorithm="elkan")
+    my_kmeans.chunk_size = 16
+    my_kmeans.cluster()
+    my_kmeans.save_model(str(tmp_path / "model.npz"))
+    loaded = kmeans()
+    loaded.load_model(str(tmp_path / "model.npz"))
+    assert loaded.clusters == 3 and loaded.algorithm == "elkan" and loaded.chunk_size == 16
+    assert np.array_equal(np.array(loaded.centroids), np.array(my_kmeans.centroids))
+    assert np.array_equal(loaded.predict(testdata_path + "point100_tab.lst"), my_kmeans.labels)
+    with pytest.raises(ValueError, match="is not a saved kmeans model"):
+        loaded.load_model(testdata_path + "point100_tab.lst")
+
+# Testing that a model file with settings save_model does not write is rejected without changing the instance
+@pytest.mark.parametrize("settings", [{"clusters": 2, "data": [[0.0, 0.0]]}, {"result": None}, [["clusters", 2]],
+                                      {"clusters": "x"}, {"clusters": 3}, {"clusters": 2, "algorithm": "fast"},
+                                      {"clusters": 2, "chunk_size": 0}, {"clusters": 2, "tol": -1}, {"clusters": 2, "dtype": "int8"}])
+def test_load_model_unknown_settings(tmp_path, settings):
+    np.savez(tmp_path / "model.npz", centroids=np.zeros((2, 2)), dims=2, settings=json.dumps(settings))
+    loaded = kmeans(testdata_path + "point100_tab.lst", 3)
+    with pytest.raises(ValueError, match="is not a saved kmeans model"):
+        loaded.load_model(str(tmp_path / "model.npz"))
+    assert loaded.clusters == 3 and loaded.data.shape == (100, 4)
+
+# Testing that a missing model or data file raises FileNotFoundError instead of exiting
+def test_missing_files(tmp_path):
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 3, seed=0)
+    my_kmeans.cluster()
+    with pytest.raises(FileNotFoundError):
+        kmeans().load_model(str(tmp_path / "missing.npz"))
+    with pytest.raises(FileNotFoundError):
+        my_kmeans.predict(str(tmp_path / "missing.lst"))
+    with pytest.raises(FileNotFoundError):
+        my_kmeans.transform(str(tmp_path / "missing.lst"))
+    with pytest.raises(FileNotFoundError):
+        next(read_blocks(str(tmp_path / "missing.lst")))
+
 
 """Testing write function in kmeans class"""
 
@@ -113,4 +687,150 @@ def test_cluster_no_data(mykmeans):
 def test_write_no_clusters(mykmeans):
     mykmeans.load(testdata_path + "point100_tab.lst")
     with pytest.raises(ValueError, match="No clusters have been assigned. Please run the cluster method before writing to file."):
-        mykmeans.write(testdata_path + "output.lst")
\ No newline at end of file
+        mykmeans.write(testdata_path + "output.lst")
+# Testing that the text output has the same layout as writing every value with str(), with and without ids
+@pytest.mark.parametrize("datafile", ["point100_tab.lst", "point100_comma_noid.lst"])
+def test_write_text_layout(tmp_path, datafile):
+    my_kmeans = kmeans(clusters=3, seed=0)
+    my_kmeans.chunk_size = 16
+    my_kmeans.load(testdata_path + datafile)
+    my_kmeans.cluster()
+    my_kmeans.write(str(tmp_path / "output.lst"))
+    expected = ""
+    for i in range(my_kmeans.clusters):
+        expected += "Cluster-" + str(i+1) + "\t" + "\t".join([str(value) for value in my_kmeans.centroids[i]]) + "\n"
+        for index in np.flatnonzero(my_kmeans.labels == i):
+            data_point = "\t".join([str(value) for value in my_kmeans.data[index]])
+            expected += (my_kmeans.ids[index] + "\t" + data_point if my_kmeans.ids else data_point) + "\n"
+    assert open(tmp_path / "output.lst").read() == expected
+
+# Testing that the labels format writes the id and cluster index (from 0, as the labels) of every point in the order of the data
+def test_write_labels(tmp_path):
+    my_kmeans = kmeans(clusters=3, seed=0)
+    my_kmeans.load(testdata_path + "point100_tab.lst")
+    my_kmeans.cluster()
+    my_kmeans.write(str(tmp_path / "labels.lst"), format="labels")
+    lines = [line.split("\t") for line in open(tmp_path / "labels.lst").read().splitlines()]
+    assert [line[0] for line in lines] == my_kmeans.ids
+    assert [int(line[1]) for line in lines] == my_kmeans.labels.tolist()
+
+# Testing that the binary formats are chosen from the extension and hold the labels, centroids and ids
+@pytest.mark.parametrize("extension", [".npz", ".cols"])
+def test_write_binary(tmp_path, extension):
+    my_kmeans = kmeans(clusters=3, seed=0)
+    my_kmeans.load(testdata_path + "point100_tab.lst")
+    my_kmeans.cluster()
+    my_kmeans.write(str(tmp_path / ("output" + extension)))
+    if extension == ".npz":
+        columns = dict(np.load(tmp_path / "output.npz"))
+    else:
+        columns = read_columns(str(tmp_path / "output.cols"))
+    assert columns["labels"].dtype == np.int32 and np.array_equal(columns["labels"], my_kmeans.labels)
+    assert np.array_equal(columns["centroids"], np.array(my_kmeans.centroids))
+    assert columns["ids"].tolist() == my_kmeans.ids
+
+# Testing if correct ValueError is raised for an unknown output format
+def test_write_unknown_format(mykmeans):
+    with pytest.raises(ValueError, match="Unknown output format: xml"):
+        mykmeans.write(None, format="xml")
+
+
+"""Testing the instrumentation of the kmeans class"""
+
+# Testing that the stage timers and counters are collected and that the callback gets every iteration
+def test_instrument_stats(tmp_path):
+    iterations = list()
+    my_kmeans = kmeans(clusters=5, seed=0)
+    my_kmeans.instrument = True
+    my_kmeans.callback = lambda iteration, inertia, shift: iterations.append((iteration, inertia, shift))
+    my_kmeans.load(testdata_path + "point100_tab.lst")
+    my_kmeans.cluster()
+    my_kmeans.write(str(tmp_path / "output.lst"))
+    stats = my_kmeans.stats
+    assert set(stats["timers"]) == {"load", "seed", "cluster", "write"}
+    assert stats["iterations"] == my_kmeans.n_iter and stats["clusterings"] == 1
+    assert stats["distance_evaluations"] == my_kmeans.n_iter * 100 * 5
+    assert stats["bytes_read"] == os.path.getsize(testdata_path + "point100_tab.lst")
+    assert stats["bytes_written"] == os.path.getsize(tmp_path / "output.lst")
+    assert [iteration for iteration, _, _ in iterations] == list(range(1, my_kmeans.n_iter + 1))
+    assert [inertia for _, inertia, _ in iterations] == my_kmeans.inertia_history
+    assert all(shift >= 0 for _, _, shift in iterations)
+    assert json.loads(my_kmeans.stats_json()) == stats
+    my_kmeans.reset_stats()
+    assert my_kmeans.stats == dict()
+
+# Testing that nothing is collected without instrumentation
+def test_instrument_off(tmp_path):
+    my_kmeans = kmeans(testdata_path + "point100_tab.lst", 5, seed=0)
+    my_kmeans.cluster()
+    my_kmeans.write(str(tmp_path / "output.lst"))
+    assert my_kmeans.stats == dict()
+
+
+"""Testing the batch mode"""
+
+# Testing that the manifest gives every file once with its numbers of clusters, relative to the manifest
+def test_read_manifest(tmp_path):
+    (tmp_path / "manifest.txt").write_text("# Nightly run\n\ndata/a.lst 3, 5\n" + str(tmp_path / "b.lst") + "\ndata/a.lst 5 8\n")
+    assert read_manifest(str(tmp_path / "manifest.txt"), [4]) == [(str(tmp_path / "data" / "a.lst"), [3, 5, 8]), (str(tmp_path / "b.lst"), [4])]
+    with pytest.raises(ValueError, match="no number of clusters for"):
+        read_manifest(str(tmp_path / "manifest.txt"))
+    (tmp_path / "manifest.txt").write_text("a.lst three\n")
+    with pytest.raises(ValueError, match="the numbers of clusters must be integers"):
+        read_manifest(str(tmp_path / "manifest.txt"))
+
+# Testing that a batch gives the same results in a process pool as one clustering at a time, and keeps going after an error
+def test_run_batch(tmp_path):
+    jobs = [(code_path + "../data/point1000.lst", [3, 5]), (testdata_path + "point100_tab.lst", [4, 101])]
+    rows = run_batch(jobs, str(tmp_path / "pool"), {"algorithm": "hamerly"}, n_jobs=2)
+    assert [(row["file"], row["clusters"]) for row in rows] == [(filename, K) for filename, numbers in jobs for K in numbers]
+    assert "Number of clusters must not exceed" in rows[3]["error"]
+    my_kmeans = kmeans(code_path + "../data/point1000.lst", 5, seed=0)
+    my_kmeans.cluster()
+    assert rows[1]["sse"] == my_kmeans.inertia
+    assert open(rows[1]["outfile"]).read().count("Cluster-") == 5
+    serial_rows = run_batch(jobs, str(tmp_path / "serial"), {"algorithm": "hamerly"}, n_jobs=1)
+    assert [row.get("sse") for row in serial_rows] == [row.get("sse") for row in rows]
+
+# Testing that a missing data file is recorded as an error and the other files are still clustered
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_run_batch_missing_file(tmp_path, n_jobs):
+    jobs = [(str(tmp_path / "missing.lst"), [3, 4]), (testdata_path + "point100_tab.lst", [3])]
+    rows = run_batch(jobs, str(tmp_path / "output"), n_jobs=n_jobs)
+    assert [row.get("error") for row in rows] == ["Data file not found", "Data file not found", None]
+    assert os.path.exists(rows[2]["outfile"])
+
+# Testing that a file whose outfile cannot be written is recorded as an error and the other files are still clustered
+def test_run_batch_write_error(tmp_path):
+    long_name = str(tmp_path / ("p" * 251 + ".lst"))
+    with open(long_name, "w") as outfile:
+        outfile.write(open(testdata_path + "point100_tab.lst").read())
+    rows = run_batch([(long_name, [3]), (testdata_path + "point100_tab.lst", [3])], str(tmp_path / "output"), n_jobs=1)
+    assert "error" in rows[0] and "name too long" in rows[0]["error"]
+    assert "error" not in rows[1] and os.path.exists(rows[1]["outfile"])
+
+# Testing the batch mode of the command line, which never waits for input
+def test_cluster_cli_batch(tmp_path):
+    command = [sys.executable, code_path + "cluster.py", "--glob", testdata_path + "point100_comma*.lst", "--clusters", "2", "3",
+               "--output_dir", str(tmp_path), "--format", "labels"]
+    result = subprocess.run(command, capture_output=True, text=True, stdin=subprocess.PIPE, timeout=60)
+    assert result.returncode == 0, result.stderr
+    summary = open(tmp_path / "summary.tsv").read()
+    assert result.stdout == summary and len(summary.splitlines()) == 1 + 2 * 2
+    assert (tmp_path / "point100_comma_noid_k3.lst").exists()
+    result = subprocess.run([sys.executable, code_path + "cluster.py", testdata_path + "point100_tab.lst"],
+                            capture_output=True, text=True, stdin=subprocess.PIPE, timeout=60)
+    assert result.returncode == 2 and "the number of clusters are needed" in result.stderr
+    # A missing file of the manifest is marked in the summary, and the exit status tells that something failed
+    (tmp_path / "manifest.txt").write_text(testdata_path + "point100_tab.lst 3\n" + str(tmp_path / "missing.lst") + " 3\n")
+    result = subprocess.run([sys.executable, code_path + "cluster.py", "--manifest", str(tmp_path / "manifest.txt"), "--output_dir", str(tmp_path / "manifest")],
+                            capture_output=True, text=True, stdin=subprocess.PIPE, timeout=60)
+    assert result.returncode == 1
+    assert "error: Data file not found" in result.stdout and (tmp_path / "manifest" / "point100_tab_k3.lst").exists()
+
+# Testing that --minibatch is a flag that may come before the positional arguments, with the batch size as its own option
+def test_cluster_cli_minibatch(tmp_path):
+    command = [sys.executable, code_path + "cluster.py", "--minibatch", "--batch_size", "20", testdata_path + "point100_tab.lst", "4", str(tmp_path / "out.lst")]
+    result = subprocess.run(command, capture_output=True, text=True, stdin=subprocess.PIPE, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert open(tmp_path / "out.lst").read().count("Cluster-") == 4
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import sys
+import pytest
+import numpy as np
+testdata_path = '/Users/johan/Documents/UNIXandPython/222110Project/test/testdata/'
+code_path = '/Users/johan/Documents/UNIXandPython/222110Project/src/'
+sys.path.append(testdata_path)
+sys.path.append(code_path)
+import matplotlib
+matplotlib.use("Agg")
+from cluster import kmeans
+from elbow_extension import calculate_E, elbow_sweep, _split_largest_cluster
+
+# Making a fixture with loaded data that will be used in all test functions
+@pytest.fixture()    
+def mykmeans():
+    return kmeans(code_path + "../data/point1000.lst", seed=0)
+
+
+"""Testing calculate_E function"""
+
+# Testing that E is the sum of squared distances from the points to their centroids
+def test_calculate_E(mykmeans):
+    mykmeans.clusters = 4
+    mykmeans.cluster()
+    expected = 0
+    for i, key in enumerate(mykmeans.cluster_dict.keys()):
+        for index in mykmeans.cluster_dict[key]:
+            expected += np.sum((mykmeans.data[index] - mykmeans.centroids[i]) ** 2)
+    assert np.isclose(calculate_E(mykmeans), expected)
+
+# Testing if correct ValueError is raised when the instance has no clustering result
+def test_calculate_E_no_result(mykmeans):
+    with pytest.raises(ValueError, match="Please run the cluster method before calculating E"):
+        calculate_E(mykmeans)
+    mykmeans.clusters = 4
+    mykmeans.partial_fit(mykmeans.data[:100])
+    with pytest.raises(ValueError, match="No clusters have been assigned"):
+        calculate_E(mykmeans)
+
+
+
+"""Testing elbow_sweep function"""
+
+# Testing that the sweep returns one E per K and gives the same values in parallel processes
+def test_elbow_sweep_parallel(mykmeans):
+    E_values = elbow_sweep(mykmeans, 6)
+    assert len(E_values) == 6
+    assert np.isclose(E_values[0], np.sum((mykmeans.data - mykmeans.data.mean(axis=0)) ** 2))
+    assert E_values[-1] < E_values[0]
+    assert elbow_sweep(mykmeans, 6, n_jobs=2) == E_values
+
+# Testing that a sweep to more clusters than points raises the same error as cluster
+@pytest.mark.parametrize("warm_start", [False, True])
+def test_elbow_sweep_too_many_clusters(warm_start):
+    with pytest.raises(ValueError, match="Number of clusters must not exceed number of obervations which is: 10"):
+        elbow_sweep(kmeans(testdata_path + "comma_sep.lst"), 12, warm_start=warm_start)
+
+# Testing the warm started sweep
+def test_elbow_sweep_warm_start(mykmeans):
+    E_values = elbow_sweep(mykmeans, 6, warm_start=True)
+    cold_E_values = elbow_sweep(mykmeans, 6)
+    assert len(E_values) == 6
+    assert np.isclose(E_values[0], cold_E_values[0])
+    assert all(E < 1.2 * cold_E for E, cold_E in zip(E_values, cold_E_values))
+
+# Testing that splitting the largest cluster adds one centroid inside that cluster
+def test_split_largest_cluster():
+    data = np.array([[0.0, 0.0], [0.1, 0.0], [10.0, 0.0], [14.0, 0.0]])
+    labels = np.array([0, 0, 1, 1])
+    centroids = np.array([[0.05, 0.0], [12.0, 0.0]])
+    new_centroids = _split_largest_cluster(data, labels, centroids)
+    assert new_centroids.shape == (3, 2)
+    assert np.array_equal(new_centroids[0], centroids[0])
+    assert sorted([new_centroids[1, 0], new_centroids[2, 0]])[0] < 12 < sorted([new_centroids[1, 0], new_centroids[2, 0]])[1]